@@ -8,10 +8,19 @@ Features:
 import os
 import discord
 import yfinance as yf
+import pandas as pd
 from dotenv import load_dotenv
 import json
+import time
+import sqlite3
+import argparse
+import threading
+import numpy as np
 import aiohttp
+import random
 import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
@@ -20,6 +29,114 @@ DISCORD_CHANNEL_ID = os.getenv('DISCORD_CHANNEL_ID')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 
+# Daemon mode
+DAEMON_INTERVAL = int(os.getenv('STOCK_BOT_INTERVAL', '300'))  # seconds between reports
+
+# Notifier: one pooled HTTP session, rate limited per platform and per destination
+DISCORD_API_URL = "https://discord.com/api/v10"
+TELEGRAM_API_URL = "https://api.telegram.org"
+# (tokens per second, burst) for the whole bot and for each chat/channel
+NOTIFY_RATE_LIMITS = {
+    "telegram": {"global": (30, 30), "destination": (1, 1)},   # 30 msg/s overall, 1 msg/s per chat
+    "discord": {"global": (50, 50), "destination": (1, 5)},    # 50 req/s overall, 5 per 5s per channel
+}
+NOTIFY_POOL_SIZE = 20         # max open connections in the shared pool
+NOTIFY_MAX_RETRIES = 5
+NOTIFY_BACKOFF_BASE = 1.0     # seconds, doubled per attempt
+NOTIFY_BACKOFF_MAX = 60.0
+NOTIFY_REQUEST_TIMEOUT = 30
+TELEGRAM_MAX_CHARS = 4096     # sendMessage text limit
+DISCORD_MAX_EMBEDS = 10       # embeds per message
+DISCORD_MAX_FIELDS = 25       # fields per embed
+DISCORD_MAX_EMBED_CHARS = 6000  # title/description/field/footer text across all embeds of a message
+DISCORD_USER_AGENT = f"DiscordBot (https://github.com/Rapptz/discord.py, {discord.__version__})"
+
+# Fetch tuning
+FETCH_BATCH_SIZE = 200    # symbols per yf.download call
+FETCH_MAX_WORKERS = 8     # threads for per-symbol fallback fetches
+
+# Price history store
+PRICE_DB_PATH = os.getenv('STOCK_BOT_PRICE_DB',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'price_history.sqlite3'))
+HISTORY_PERIOD = "1y"     # backfill for symbols seen for the first time
+
+# Market data cache: quotes are fresh for the TTL of their asset class and may be
+# served stale (while refreshed in the background) for up to STALE_FACTOR x TTL
+MARKET_DATA_TTLS = {"fx": 30, "index": 60, "equity": 60}  # seconds
+MARKET_DATA_STALE_FACTOR = 2
+REFRESH_WAIT_TIMEOUT = 60  # one-shot runs wait this long for background refreshes before exiting
+
+# Alert rules
+ALERT_STATE_PATH = os.getenv('STOCK_BOT_ALERT_STATE',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_state.json'))
+ALERT_COOLDOWN_HOURS = 4  # default per-rule cooldown between two alerts
+# Rule type -> (required numeric params, optional window params that must be positive integers)
+RULE_PARAMS = {
+    "price_above": (("value",), ()),
+    "price_below": (("value",), ()),
+    "pct_move": (("value",), ()),
+    "ma_cross": ((), ("fast", "slow")),
+    "volatility_spike": ((), ("window",)),
+}
+
+# Destinations and the tickers each one receives (optional; see load_subscriptions)
+SUBSCRIPTIONS_PATH = os.getenv('STOCK_BOT_SUBSCRIPTIONS',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subscriptions.json'))
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def rule_problem(rule):
+    """Why a rule from tickers.json cannot be evaluated, or None if it is valid."""
+    if not isinstance(rule, dict):
+        return "not an object"
+    if "type" not in rule:
+        return "missing 'type'"
+    if rule["type"] not in RULE_PARAMS:
+        return f"unknown type {rule.get('type')!r}"
+    required, windows = RULE_PARAMS[rule["type"]]
+    for param in required:
+        if not _is_number(rule.get(param)):
+            return f"'{param}' must be a number"
+    for param in windows:
+        if param in rule and not (isinstance(rule[param], int) and not isinstance(rule[param], bool)
+                                  and rule[param] > 0):
+            return f"'{param}' must be a positive integer"
+    for param in ("multiple", "cooldown_hours"):
+        if param in rule and not _is_number(rule[param]):
+            return f"'{param}' must be a number"
+    return None
+
+def parse_watchlist(entries):
+    """Splits tickers.json into ({name: symbol}, {name: rules}).
+
+    Entries are either "Name": "SYMBOL" or "Name": {"symbol": "SYMBOL", "rules": [...]}.
+    Entries without a symbol and rules that cannot be evaluated are skipped with a warning.
+    """
+    if not isinstance(entries, dict):
+        print("Error: tickers.json must be an object of \"Name\": \"SYMBOL\" entries")
+        return {}, {}
+    tickers, rules = {}, {}
+    for name, entry in entries.items():
+        symbol, symbol_rules = (entry.get("symbol"), entry.get("rules", [])) if isinstance(entry, dict) else (entry, [])
+        if not isinstance(symbol, str) or not symbol:
+            print(f"Warning: Skipping ticker '{name}' without a symbol: {entry}")
+            continue
+        tickers[name] = symbol
+        if not isinstance(symbol_rules, list):
+            print(f"Warning: 'rules' for {name} must be a list, ignoring them")
+            continue
+        valid = []
+        for rule in symbol_rules:
+            problem = rule_problem(rule)
+            if problem:
+                print(f"Warning: Skipping rule for {name} ({problem}): {rule}")
+            else:
+                valid.append(rule)
+        if valid:
+            rules[name] = valid
+    return tickers, rules
+
 # Load tickers from external JSON file
 try:
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -33,32 +150,335 @@ except json.JSONDecodeError:
     print("Error: Failed to decode tickers.json")
     TICKERS = {}
 
-def get_market_data(symbol):
-    print(f"Fetching data for {symbol}...")
-    ticker = yf.Ticker(symbol)
-    data = ticker.history(period="1d")
-    
+TICKERS, RULES = parse_watchlist(TICKERS)
+
+# --- Price History Store ---
+
+BAR_DTYPE = np.dtype([("ts", "i8"), ("open", "f8"), ("high", "f8"), ("low", "f8"),
+                      ("close", "f8"), ("volume", "f8")])
+BAR_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+class PriceStore:
+    """Local daily OHLCV history in SQLite, one row per symbol and day.
+
+    Reads come back as NumPy structured arrays (BAR_DTYPE, `ts` in epoch seconds
+    at midnight UTC of the bar's date), so indicators never need to refetch.
+    """
+    def __init__(self, path=PRICE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bars (symbol TEXT NOT NULL, ts INTEGER NOT NULL, open REAL, high REAL, "
+            "low REAL, close REAL, volume REAL, PRIMARY KEY (symbol, ts)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def append(self, rows):
+        """Upserts (symbol, ts, open, high, low, close, volume) rows. Returns the row count."""
+        rows = list(rows)
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def last_timestamps(self):
+        """{symbol: ts of its most recent stored bar}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT symbol, MAX(ts) FROM bars GROUP BY symbol").fetchall())
+
+    def history(self, symbol, start=None, end=None):
+        """Bars of a symbol, oldest first, optionally limited to [start, end] epoch seconds."""
+        query = "SELECT ts, open, high, low, close, volume FROM bars WHERE symbol = ?"
+        args = [symbol]
+        if start is not None:
+            query += " AND ts >= ?"
+            args.append(start)
+        if end is not None:
+            query += " AND ts <= ?"
+            args.append(end)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY ts", args).fetchall()
+        return np.array(rows, dtype=BAR_DTYPE)
+
+    def tail(self, symbol, n):
+        """The last n bars of a symbol, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, open, high, low, close, volume FROM bars WHERE symbol = ? ORDER BY ts DESC LIMIT ?",
+                (symbol, n),
+            ).fetchall()
+        return np.array(rows[::-1], dtype=BAR_DTYPE)
+
+_price_store = None
+
+def get_price_store():
+    """Returns the process-wide price store, opening it on first use."""
+    global _price_store
+    if _price_store is None:
+        _price_store = PriceStore()
+    return _price_store
+
+def _bar_timestamps(index):
+    """Epoch seconds at midnight UTC of each bar's (exchange-local) date."""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return (index.normalize().values.astype("datetime64[s]").astype(np.int64)).tolist()
+
+def frame_to_rows(symbol, data):
+    """Store rows for one symbol's OHLCV DataFrame (incomplete bars are skipped)."""
+    data = data.dropna(subset=['Open', 'Close'])
+    values = data.reindex(columns=BAR_FIELDS).to_numpy(dtype=float)
+    return [(symbol, ts, *map(float, row)) for ts, row in zip(_bar_timestamps(data.index), values)]
+
+def batch_to_rows(data, symbols):
+    """Store rows for a multi-symbol yf.download frame, extracted for all symbols at once."""
+    present = [s for s in symbols if s in set(data.columns.get_level_values(0))]
+    fields = {field: data.xs(field, axis=1, level=1).reindex(columns=present).to_numpy(dtype=float)
+              for field in BAR_FIELDS if field in set(data.columns.get_level_values(1))}
+    complete = ~np.isnan(fields['Open']) & ~np.isnan(fields['Close'])
+    timestamps = _bar_timestamps(data.index)
+    rows = []
+    for day, col in zip(*np.nonzero(complete)):
+        rows.append((present[col], timestamps[day],
+                     *(float(fields[f][day, col]) if f in fields else None for f in BAR_FIELDS)))
+    return rows
+
+def fetch_history(symbol, start=None):
+    """Per-symbol fallback: daily bars since `start` (a date string) or for HISTORY_PERIOD."""
+    print(f"Fetching history for {symbol}...")
+    try:
+        if start:
+            data = yf.Ticker(symbol).history(start=start, interval="1d")
+        else:
+            data = yf.Ticker(symbol).history(period=HISTORY_PERIOD, interval="1d")
+    except Exception as e:
+        print(f"Warning: History fetch failed for {symbol}: {e}")
+        return []
     if data.empty:
         print(f"Warning: No data found for {symbol}")
-        return None, None
-    
-    # Get the most recent close 
-    current_price = data['Close'].iloc[-1]
-    open_price = data['Open'].iloc[-1]
-    
-    # Calculate daily change percentage
-    change_percent = ((current_price - open_price) / open_price) * 100
-    
-    return current_price, change_percent
+        return []
+    return frame_to_rows(symbol, data)
+
+def download_bars(symbols, start=None):
+    """Batched yf.download of daily bars since `start` (or HISTORY_PERIOD). Returns store rows."""
+    rows = []
+    for offset in range(0, len(symbols), FETCH_BATCH_SIZE):
+        batch = symbols[offset:offset + FETCH_BATCH_SIZE]
+        print(f"Downloading {len(batch)} symbols in one batch (since {start or HISTORY_PERIOD})...")
+        try:
+            if start:
+                data = yf.download(batch, start=start, interval="1d", group_by="ticker", threads=True,
+                                   progress=False, multi_level_index=True)
+            else:
+                data = yf.download(batch, period=HISTORY_PERIOD, interval="1d", group_by="ticker", threads=True,
+                                   progress=False, multi_level_index=True)
+        except Exception as e:
+            print(f"Warning: Batch download failed: {e}")
+            continue
+        if data is not None and not data.empty:
+            rows.extend(batch_to_rows(data, batch))
+    return rows
+
+def sync_price_history(symbols, store):
+    """Fetches only the bars each symbol is missing and appends them to the store.
+
+    The last stored bar is fetched again because today's bar changes until the
+    close. Symbols are grouped by start date so each group is one batched download;
+    whatever a batch misses is retried per symbol on a small thread pool.
+    Returns the set of symbols that received data.
+    """
+    last = store.last_timestamps()
+    groups = {}
+    for symbol in symbols:
+        start = time.strftime("%Y-%m-%d", time.gmtime(last[symbol])) if symbol in last else None
+        groups.setdefault(start, []).append(symbol)
+
+    updated = set()
+    for start, group in groups.items():
+        rows = download_bars(group, start)
+        store.append(rows)
+        updated.update(row[0] for row in rows)
 
-def fetch_all_market_data():
-    """Fetches data for all tickers and returns a clean dictionary."""
+        missing = [symbol for symbol in group if symbol not in updated]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(missing))) as pool:
+                for rows in pool.map(lambda symbol: fetch_history(symbol, start), missing):
+                    store.append(rows)
+                    updated.update(row[0] for row in rows)
+    return updated
+
+def fetch_quotes(symbols, store=None):
+    """Upstream fetch: syncs the price history, then quotes each symbol's latest bar.
+
+    Returns {symbol: {"price", "change"}} for the symbols that received data.
+    """
+    store = store or get_price_store()
+    quotes = {}
+    for symbol in sync_price_history(symbols, store):
+        bar = store.tail(symbol, 1)[0]
+        quotes[symbol] = {"price": float(bar["close"]),
+                          "change": float((bar["close"] - bar["open"]) / bar["open"] * 100)}
+    return quotes
+
+# --- Market Data Cache ---
+
+def asset_class(symbol):
+    """Yahoo symbol conventions: "KRW=X" is FX, "^GSPC" is an index, anything else an equity."""
+    if symbol.endswith("=X"):
+        return "fx"
+    if symbol.startswith("^"):
+        return "index"
+    return "equity"
+
+class MarketDataCache:
+    """Quote cache with per-asset-class TTLs, stale-while-revalidate and a SQLite backing.
+
+    Fresh quotes are served from memory. Expired quotes within the stale window are
+    served immediately while one background thread refreshes them; anything older
+    (or never seen) is fetched synchronously in one batch. Symbols the upstream had
+    no data for are not asked for again until their TTL passes. Quotes are also written
+    to disk, so a restart or the next cron run starts warm.
+    """
+    def __init__(self, fetcher, path=PRICE_DB_PATH, ttls=None, stale_factor=MARKET_DATA_STALE_FACTOR):
+        self.fetcher = fetcher
+        self.ttls = {**MARKET_DATA_TTLS, **(ttls or {})}
+        self.stale_factor = stale_factor
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+        self.upstream_latencies = []
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._failed = {}  # symbol -> time the upstream last returned nothing for it
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quote-refresh")
+        self._pending = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS quotes (symbol TEXT PRIMARY KEY, price REAL NOT NULL, "
+            "change REAL NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._quotes = {symbol: ({"price": price, "change": change}, fetched_at)
+                        for symbol, price, change, fetched_at in self._conn.execute("SELECT * FROM quotes")}
+
+    def _fetch(self, symbols):
+        start = time.perf_counter()
+        try:
+            quotes = self.fetcher(symbols)
+        finally:
+            with self._lock:
+                self.upstream_calls += 1
+                self.upstream_latencies.append(time.perf_counter() - start)
+                del self.upstream_latencies[:-1000]
+        now = time.time()
+        with self._lock:
+            for symbol in symbols:
+                if symbol not in quotes:
+                    self._failed[symbol] = now
+            for symbol, quote in quotes.items():
+                self._quotes[symbol] = (quote, now)
+                self._failed.pop(symbol, None)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?)",
+                [(symbol, quote["price"], quote["change"], now) for symbol, quote in quotes.items()],
+            )
+            self._conn.commit()
+        return quotes
+
+    def _refresh(self, symbols):
+        try:
+            self._fetch(symbols)
+        except Exception as e:
+            print(f"Warning: Background refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(symbols)
+
+    def get_quotes(self, symbols):
+        """Returns {symbol: quote} for every symbol with fresh, stale or newly fetched data."""
+        now = time.time()
+        result, stale, missing = {}, [], []
+        with self._lock:
+            for symbol in symbols:
+                quote, fetched_at = self._quotes.get(symbol, (None, 0))
+                ttl = self.ttls[asset_class(symbol)]
+                age = now - fetched_at
+                if quote is not None and age < ttl:
+                    self.hits += 1
+                    result[symbol] = quote
+                elif quote is not None and age < ttl * self.stale_factor:
+                    self.stale_hits += 1
+                    result[symbol] = quote
+                    if symbol not in self._refreshing:
+                        stale.append(symbol)
+                else:
+                    self.misses += 1
+                    # Symbols that just came back empty are not retried until their TTL passes
+                    if now - self._failed.get(symbol, 0) >= ttl:
+                        missing.append(symbol)
+            self._refreshing.update(stale)
+        if stale:
+            self._pending = [f for f in self._pending if not f.done()]
+            self._pending.append(self._refresher.submit(self._refresh, stale))
+        if missing:
+            result.update(self._fetch(missing))
+        return result
+
+    def wait_for_refresh(self, timeout=REFRESH_WAIT_TIMEOUT):
+        """Blocks until background refreshes finish (used before a one-shot run exits)."""
+        pending, self._pending = self._pending, []
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            latencies = np.array(self.upstream_latencies) * 1000
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "upstream_calls": self.upstream_calls,
+            "upstream_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "upstream_p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        }
+
+_market_cache = None
+
+def get_market_cache():
+    """Returns the process-wide market data cache, opening it on first use."""
+    global _market_cache
+    if _market_cache is None:
+        _market_cache = MarketDataCache(fetch_quotes)
+    return _market_cache
+
+def fetch_all_market_data(cache=None, tickers=None):
+    """Fetches data for all tickers (or the given {name: symbol} subset) and returns a clean dictionary.
+
+    Quotes come from the market data cache; upstream fetches append new bars to
+    the price history store and quote each symbol's latest stored bar.
+    """
     results = {}
+    cache = cache or get_market_cache()
+    tickers = TICKERS if tickers is None else tickers
     print("\n--- Starting Data Fetch ---")
-    for name, symbol in TICKERS.items():
-        price, change = get_market_data(symbol)
-        if price is not None:
-            results[name] = {"price": price, "change": change}
+    symbols = list(dict.fromkeys(tickers.values()))
+    quotes = cache.get_quotes(symbols)
+
+    for name, symbol in tickers.items():
+        if symbol in quotes:
+            results[name] = dict(quotes[symbol])
+    stats = cache.stats()
+    print(f"Cache: {stats['hits']} fresh, {stats['stale_hits']} stale, {stats['misses']} missed "
+          f"(hit rate {stats['hit_rate']:.0%}, {stats['upstream_calls']} upstream calls)")
     print("--- Data Fetch Complete ---\n")
     return results
 
@@ -90,7 +510,9 @@ class MarketReport(dict):
         
     def add_ticker(self, name, price, change):
         self["items"].append(format_ticker_data(name, price, change))
-        
+
+    def add_alert(self, name, message):
+        self.setdefault("alerts", []).append({"name": name, "message": message})
 
 def prepare_market_report(market_data):
     """Creates/Factory for the MarketReport object."""
@@ -99,76 +521,224 @@ def prepare_market_report(market_data):
         report.add_ticker(name, data['price'], data['change'])
     return report
 
-# --- Discord Logic ---
+def prepare_alert_report(alerts, market_data):
+    """MarketReport with only the tickers that triggered alerts, plus the alert messages."""
+    report = MarketReport(title="🚨 Market Alerts", description=f"{len(alerts)} alert(s) triggered")
+    for name in dict.fromkeys(alert["name"] for alert in alerts):
+        if name in market_data:
+            report.add_ticker(name, market_data[name]['price'], market_data[name]['change'])
+    for alert in alerts:
+        report.add_alert(alert["name"], alert["message"])
+    return report
 
-class DiscordOneShotBot(discord.Client):
-    def __init__(self, report, channel_id, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.report = report
-        self.channel_id = int(channel_id)
+# --- Rules Logic ---
+# Each evaluator maps a bar history (BAR_DTYPE array, oldest first) to one state per
+# bar it can judge, computed for the whole series at once; alerts fire on state changes.
 
-    async def on_ready(self):
-        print(f'[Discord] Logged in as {self.user}')
-        try:
-            channel = self.get_channel(self.channel_id)
-            if not channel:
-                try:
-                    channel = await self.fetch_channel(self.channel_id)
-                except Exception as e:
-                    print(f"[Discord] Error fetching channel: {e}")
-                    await self.close()
-                    return
-
-            # Construct Embed from MarketReport schema
-            embed = discord.Embed(
-                title=self.report["title"],
-                description=self.report["description"],
-                color=0x3498db
-            )
-            
-            for item in self.report["items"]:
-                # Discord formatting: "$123.45 (📈 +1.23%)"
-                embed.add_field(
-                    name=item["name"], 
-                    value=f"{item['value']} ({item['emoji']} {item['change']})", 
-                    inline=True
-                )
-            
-            embed.set_footer(text=self.report["footer"])
-            
-            print(f"[Discord] Sending embed to #{channel.name}...")
-            await channel.send(embed=embed)
-            print("[Discord] Message sent!")
-            
-        except Exception as e:
-            print(f"[Discord] Error: {e}")
-        finally:
-            print("[Discord] Closing connection...")
-            await self.close()
+def _sma(values, window):
+    """Simple moving average; the first window-1 entries are NaN."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        out[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+    return out
 
-async def run_discord_task(report):
-    if not DISCORD_TOKEN or not DISCORD_CHANNEL_ID:
-        print("[Discord] configuration missing, skipping.")
-        return
+def _rule_price_above(bars, rule):
+    return bars["close"] > rule["value"]
+
+def _rule_price_below(bars, rule):
+    return bars["close"] < rule["value"]
+
+def _rule_pct_move(bars, rule):
+    move = (bars["close"] - bars["open"]) / bars["open"] * 100
+    return np.abs(move) >= rule["value"]
+
+def _rule_ma_cross(bars, rule):
+    fast, slow = _sma(bars["close"], rule.get("fast", 20)), _sma(bars["close"], rule.get("slow", 50))
+    valid = ~np.isnan(slow)
+    return np.where(fast[valid] > slow[valid], "above", "below")
+
+def _rule_volatility_spike(bars, rule):
+    window = rule.get("window", 20)
+    returns = np.diff(np.log(bars["close"]))
+    if len(returns) <= window:
+        return np.array([], dtype=bool)
+    # Std of the `window` returns before each day, for every day at once
+    past = np.lib.stride_tricks.sliding_window_view(returns[:-1], window)
+    return np.abs(returns[window:]) > rule.get("multiple", 2.0) * past.std(axis=1, ddof=1)
 
-    intents = discord.Intents.default()
-    bot = DiscordOneShotBot(report, DISCORD_CHANNEL_ID, intents=intents)
+RULE_TYPES = {
+    "price_above": _rule_price_above,
+    "price_below": _rule_price_below,
+    "pct_move": _rule_pct_move,
+    "ma_cross": _rule_ma_cross,
+    "volatility_spike": _rule_volatility_spike,
+}
+
+# A new bar meeting these conditions is a new event, even if the previous bar met them too
+EVENT_RULES = {"pct_move", "volatility_spike"}
+
+def _rule_state(rule, states, bars, position):
+    """Persistable state of a rule at a bar; event rules are keyed by the bar's timestamp."""
+    value = states[position].item()
+    if rule["type"] in EVENT_RULES and value:
+        return int(bars["ts"][position])
+    return value
+
+def rule_key(name, rule):
+    """Stable identity of a rule, independent of its position in tickers.json."""
+    params = {k: v for k, v in rule.items() if k != "cooldown_hours"}
+    return f"{name}|{json.dumps(params, sort_keys=True)}"
+
+def rule_bars_needed(rule):
+    if rule["type"] == "ma_cross":
+        return rule.get("slow", 50) + 1
+    if rule["type"] == "volatility_spike":
+        return rule.get("window", 20) + 2
+    return 2
+
+def describe_alert(rule, state, bars):
+    close = bars["close"][-1]
+    if rule["type"] == "price_above":
+        return f"crossed above {rule['value']:,.2f} (now {close:,.2f})"
+    if rule["type"] == "price_below":
+        return f"fell below {rule['value']:,.2f} (now {close:,.2f})"
+    if rule["type"] == "pct_move":
+        move = (close - bars["open"][-1]) / bars["open"][-1] * 100
+        return f"moved {move:+.2f}% today (threshold ±{rule['value']}%)"
+    if rule["type"] == "ma_cross":
+        kind = "Golden cross" if state == "above" else "Death cross"
+        return f"{kind}: SMA{rule.get('fast', 20)} crossed {state} SMA{rule.get('slow', 50)}"
+    returns = np.diff(np.log(bars["close"]))
+    window = rule.get("window", 20)
+    sigma = returns[-window - 1:-1].std(ddof=1)
+    return f"Volatility spike: {np.expm1(returns[-1]) * 100:+.2f}% move is {abs(returns[-1]) / sigma:.1f}σ " \
+           f"of the last {window} days"
+
+def load_alert_state(path=ALERT_STATE_PATH):
     try:
-        await bot.start(DISCORD_TOKEN)
-    except Exception as e:
-        print(f"[Discord] Failed to start bot: {e}")
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-# --- Telegram Logic ---
+def save_alert_state(state, path=ALERT_STATE_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
 
-async def run_telegram_task(report):
-    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
-        print("[Telegram] configuration missing, skipping.")
-        return
+def evaluate_rules(store, rules=None, tickers=None, state_path=ALERT_STATE_PATH, now=None):
+    """Evaluates every configured rule against the stored history. Returns alert dicts.
 
-    print("[Telegram] Preparing message...")
-    
-    # Construct message from MarketReport schema
-    
+    An alert fires only when a rule's state changes (e.g. the price moves from below
+    to above a level, or a new bar makes a large move) into an alerting state, and
+    not again within the rule's cooldown. For a rule seen for the first time, the state of the previous bar is
+    used as its prior state. States and alert times persist in `state_path`.
+    """
+    rules = RULES if rules is None else rules
+    tickers = TICKERS if tickers is None else tickers
+    now = time.time() if now is None else now
+    state = load_alert_state(state_path)
+    alerts = []
+    for name, symbol_rules in rules.items():
+        # Rules from tickers.json are validated on load; callers may pass their own
+        symbol_rules = [rule for rule in symbol_rules if rule_problem(rule) is None]
+        if not symbol_rules or name not in tickers:
+            continue
+        needed = max(rule_bars_needed(rule) for rule in symbol_rules)
+        bars = store.tail(tickers[name], needed)
+        for rule in symbol_rules:
+            states = RULE_TYPES[rule["type"]](bars, rule) if len(bars) else []
+            if len(states) == 0:
+                continue
+            current = _rule_state(rule, states, bars, -1)
+            key = rule_key(name, rule)
+            entry = state.setdefault(key, {})
+            previous = entry.get("state", _rule_state(rule, states, bars, -2) if len(states) > 1 else None)
+            entry["state"] = current
+
+            # ma_cross alerts on any flip; other rules only when they become true (or on a new bar)
+            fired = current != previous and previous is not None and \
+                (rule["type"] == "ma_cross" or current is not False)
+            cooldown = rule.get("cooldown_hours", ALERT_COOLDOWN_HOURS) * 3600
+            if fired and now - entry.get("last_alert", 0) >= cooldown:
+                entry["last_alert"] = now
+                alerts.append({"name": name, "symbol": tickers[name], "rule": rule["type"],
+                               "message": describe_alert(rule, current, bars)})
+    save_alert_state(state, state_path)
+    return alerts
+
+def build_reports(market_data, subscriptions, store=None):
+    """The report for each destination this cycle, as {destination: MarketReport}.
+
+    Without any rules in tickers.json every subscribed ticker is reported; with
+    rules, only alerts are, and destinations whose tickers had none are left out.
+    Rules are evaluated once for all subscribed tickers, and destinations with the
+    same ticker subset share one report.
+    """
+    alerts = None
+    if RULES:
+        names = set().union(*subscriptions.values())
+        alerts = evaluate_rules(store or get_price_store(),
+                                tickers={name: TICKERS[name] for name in names})
+        if not alerts:
+            print("No alerts triggered.")
+            return {}
+
+    reports = {}
+    by_subset = {}
+    for destination, names in subscriptions.items():
+        if names not in by_subset:
+            if alerts is None:
+                subset = {name: market_data[name] for name in names if name in market_data}
+                by_subset[names] = prepare_market_report(subset) if subset else None
+            else:
+                matched = [alert for alert in alerts if alert["name"] in names]
+                by_subset[names] = prepare_alert_report(matched, market_data) if matched else None
+        if by_subset[names] is not None:
+            reports[destination] = by_subset[names]
+    return reports
+
+# --- Discord Logic ---
+
+def discord_embed_chars(embed):
+    """Counts the characters Discord charges against the per-message embed limit."""
+    return (len(embed.get("title", "")) + len(embed.get("description", ""))
+            + sum(len(field["name"]) + len(field["value"]) for field in embed.get("fields", []))
+            + len(embed.get("footer", {}).get("text", ""))
+            + len(embed.get("author", {}).get("name", "")))
+
+
+def build_discord_embeds(report):
+    """Constructs Discord Embeds from the MarketReport schema.
+
+    Reports with more tickers than fit into one embed are continued in
+    further embeds so that each stays within Discord's field and size limits.
+    """
+    fields = [(item["name"], f"{item['value']} ({item['emoji']} {item['change']})", True)
+              for item in report["items"]]  # Discord formatting: "$123.45 (📈 +1.23%)"
+    fields += [(f"🚨 {alert['name']}", alert["message"], False) for alert in report.get("alerts", [])]
+
+    embeds = []
+    embed = discord.Embed(title=report["title"], description=report["description"], color=0x3498db)
+    budget = DISCORD_MAX_EMBED_CHARS - len(report["footer"]) - discord_embed_chars(embed.to_dict())
+    for name, value, inline in fields:
+        if len(embed.fields) == DISCORD_MAX_FIELDS or len(name) + len(value) > budget:
+            embeds.append(embed)
+            embed = discord.Embed(title=f"{report['title']} (cont.)", color=0x3498db)
+            budget = DISCORD_MAX_EMBED_CHARS - len(report["footer"]) - len(embed.title)
+        embed.add_field(name=name, value=value, inline=inline)
+        budget -= len(name) + len(value)
+
+    embed.set_footer(text=report["footer"])
+    embeds.append(embed)
+    return embeds
+
+# --- Telegram Logic ---
+
+def format_telegram_message(report):
+    """Builds the Markdown message text from the MarketReport schema."""
     # 1. Title
     lines = [f"*{report['title']}*"]
     
@@ -182,6 +752,9 @@ async def run_telegram_task(report):
     for item in report["items"]:
         # Telegram formatting: "📈 *Name*: $123.45 (+1.23%)"
         lines.append(f"{item['emoji']} *{item['name']}*: {item['value']} ({item['change']})")
+
+    for alert in report.get("alerts", []):
+        lines.append(f"🚨 *{alert['name']}*: {alert['message']}")
     
     lines.append("") # Spacer
 
@@ -189,60 +762,334 @@ async def run_telegram_task(report):
     if report.get("footer"):
         lines.append(f"`{report['footer']}`")
     
-    message = "\n".join(lines)
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "parse_mode": "Markdown"
-    }
-    
-    async with aiohttp.ClientSession() as session:
+    return "\n".join(lines)
+
+# --- Notifier Logic ---
+
+Destination = namedtuple("Destination", ["platform", "target"])
+
+def load_subscriptions(path=SUBSCRIPTIONS_PATH):
+    """Reads subscriptions.json: a list of {"platform", "target", "tickers"} entries.
+
+    `platform` is "discord" (target = channel ID) or "telegram" (target = chat ID);
+    `tickers` lists names from tickers.json and defaults to all of them.
+    Returns {Destination: tuple of ticker names}.
+    """
+    try:
+        with open(path, 'r') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        print(f"Error: Failed to decode {os.path.basename(path)}")
+        return {}
+
+    if not isinstance(entries, list):
+        print(f"Error: {os.path.basename(path)} must be a list of subscriptions")
+        return {}
+
+    subscriptions = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            print(f"Warning: Skipping subscription that is not an object: {entry}")
+            continue
+        platform, target = entry.get("platform"), entry.get("target")
+        if platform not in NOTIFY_RATE_LIMITS or not isinstance(target, (str, int)) \
+                or isinstance(target, bool) or target == "":
+            print(f"Warning: Skipping subscription with unknown platform or missing target: {entry}")
+            continue
+        names = entry.get("tickers", list(TICKERS))
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            print(f"Warning: Skipping subscription {platform}:{target}: 'tickers' must be a list of names")
+            continue
+        names = names or list(TICKERS)
+        unknown = [name for name in names if name not in TICKERS]
+        if unknown:
+            print(f"Warning: Unknown tickers for {platform}:{entry['target']}: {', '.join(unknown)}")
+        destination = Destination(platform, str(entry["target"]))
+        subscriptions[destination] = tuple(name for name in names if name in TICKERS)
+    return subscriptions
+
+def configured_subscriptions(path=SUBSCRIPTIONS_PATH):
+    """Every destination we can deliver to, mapped to the ticker names it receives.
+
+    DISCORD_CHANNEL_ID / TELEGRAM_CHAT_ID from the environment stay the default
+    destinations (all tickers); subscriptions.json adds more or narrows them.
+    Destinations of a platform without a token are skipped.
+    """
+    subscriptions = {}
+    if DISCORD_CHANNEL_ID:
+        subscriptions[Destination("discord", str(DISCORD_CHANNEL_ID))] = tuple(TICKERS)
+    if TELEGRAM_CHAT_ID:
+        subscriptions[Destination("telegram", str(TELEGRAM_CHAT_ID))] = tuple(TICKERS)
+    subscriptions.update(load_subscriptions(path))
+
+    tokens = {"discord": DISCORD_TOKEN, "telegram": TELEGRAM_TOKEN}
+    for platform, token in tokens.items():
+        if not any(destination.platform == platform for destination in subscriptions):
+            print(f"[{platform.capitalize()}] configuration missing, skipping.")
+        elif not token:
+            print(f"[{platform.capitalize()}] token missing, skipping its destinations.")
+    return {destination: names for destination, names in subscriptions.items()
+            if tokens[destination.platform] and names}
+
+def subscribed_tickers(subscriptions):
+    """{name: symbol} for the union of all subscribed tickers, in tickers.json order."""
+    names = set().union(*subscriptions.values())
+    return {name: symbol for name, symbol in TICKERS.items() if name in names}
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, holding at most `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def pause(self, seconds):
+        """Blocks the bucket (e.g. after a 429 with retry_after)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Notifier:
+    """Delivers reports to Discord channels and Telegram chats over one pooled aiohttp session.
+
+    `submit` only enqueues. A dispatcher renders each report for its platform and hands
+    it to a per-destination sender, which coalesces everything pending for that
+    destination into as few messages as possible, waits on the platform and destination
+    token buckets, and retries 429s (honoring retry_after), 5xx and connection errors
+    with exponential backoff. Discord is sent through the REST API, so no gateway
+    login is needed.
+    """
+    def __init__(self, discord_token=DISCORD_TOKEN, telegram_token=TELEGRAM_TOKEN,
+                 rate_limits=NOTIFY_RATE_LIMITS, max_retries=NOTIFY_MAX_RETRIES):
+        self.discord_token = discord_token
+        self.telegram_token = telegram_token
+        self.rate_limits = rate_limits
+        self.max_retries = max_retries
+        self.session = None
+        self._queue = asyncio.Queue()
+        self._dispatcher = None
+        self._pending = {}   # destination -> rendered messages waiting to be sent
+        self._senders = {}   # destination -> sender task
+        self._global_buckets = {platform: TokenBucket(*limits["global"]) for platform, limits in rate_limits.items()}
+        self._buckets = {}
+        self.counters = {"submitted": 0, "sent": 0, "coalesced": 0, "retries": 0, "failed": 0}
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=NOTIFY_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=NOTIFY_REQUEST_TIMEOUT),
+        )
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
         try:
-            async with session.post(url, json=payload) as response:
-                if response.status == 200:
-                    print("[Telegram] Message sent successfully!")
+            if exc_type is None:
+                await self.flush()
+        finally:
+            self._dispatcher.cancel()
+            for task in self._senders.values():
+                task.cancel()
+            await self.session.close()
+
+    def submit(self, destination, report):
+        """Queues `report` for `destination`; returns immediately."""
+        self.counters["submitted"] += 1
+        self._queue.put_nowait((destination, report))
+
+    async def flush(self):
+        """Waits until every submitted report has been delivered (or given up on)."""
+        await self._queue.join()
+        while True:
+            active = [task for task in self._senders.values() if not task.done()]
+            if not active:
+                return
+            await asyncio.gather(*active, return_exceptions=True)
+
+    def stats(self):
+        return dict(self.counters)
+
+    def _bucket(self, destination):
+        if destination not in self._buckets:
+            self._buckets[destination] = TokenBucket(*self.rate_limits[destination.platform]["destination"])
+        return self._buckets[destination]
+
+    def _render(self, destination, report):
+        if destination.platform == "discord":
+            return [embed.to_dict() for embed in build_discord_embeds(report)]
+        return format_telegram_message(report)
+
+    async def _dispatch(self):
+        while True:
+            destination, report = await self._queue.get()
+            try:
+                self._pending.setdefault(destination, []).append(self._render(destination, report))
+                sender = self._senders.get(destination)
+                if sender is None or sender.done():
+                    self._senders[destination] = asyncio.create_task(self._drain(destination))
+            except Exception as e:
+                self.counters["failed"] += 1
+                print(f"[Notifier] Could not queue report for {destination.platform}:{destination.target}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _drain(self, destination):
+        # Whatever piles up while we wait on the rate limiter is merged into the next message
+        while self._pending.get(destination):
+            messages = self._pending.pop(destination)
+            payloads = self._coalesce(destination, messages)
+            # A long Discord report can need several messages on its own; count only what merging saved
+            standalone = sum(len(self._coalesce(destination, [message])) for message in messages)
+            self.counters["coalesced"] += standalone - len(payloads)
+            for payload in payloads:
+                await self._send(destination, payload)
+
+    def _coalesce(self, destination, messages):
+        if destination.platform == "discord":
+            batches = []
+            for embed in (embed for embeds in messages for embed in embeds):
+                size = discord_embed_chars(embed)
+                if (batches and len(batches[-1]["embeds"]) < DISCORD_MAX_EMBEDS
+                        and batches[-1]["chars"] + size <= DISCORD_MAX_EMBED_CHARS):
+                    batches[-1]["embeds"].append(embed)
+                    batches[-1]["chars"] += size
                 else:
-                    text = await response.text()
-                    print(f"[Telegram] Failed to send: {text}")
-        except Exception as e:
-            print(f"[Telegram] Connection error: {e}")
+                    batches.append({"embeds": [embed], "chars": size})
+            return [{"embeds": batch["embeds"]} for batch in batches]
+        texts = []
+        for text in messages:
+            if texts and len(texts[-1]) + 2 + len(text) <= TELEGRAM_MAX_CHARS:
+                texts[-1] += "\n\n" + text
+            else:
+                texts.append(text[:TELEGRAM_MAX_CHARS])
+        return [{"chat_id": destination.target, "text": text, "parse_mode": "Markdown"} for text in texts]
+
+    def _request(self, destination):
+        if destination.platform == "discord":
+            return (f"{DISCORD_API_URL}/channels/{destination.target}/messages",
+                    {"Authorization": f"Bot {self.discord_token}", "User-Agent": DISCORD_USER_AGENT})
+        return f"{TELEGRAM_API_URL}/bot{self.telegram_token}/sendMessage", {}
+
+    def _backoff(self, attempt):
+        return min(NOTIFY_BACKOFF_MAX, NOTIFY_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def _send(self, destination, payload):
+        label = f"[{destination.platform.capitalize()}] {destination.target}"
+        url, headers = self._request(destination)
+        global_bucket = self._global_buckets[destination.platform]
+        bucket = self._bucket(destination)
+        for attempt in range(self.max_retries + 1):
+            await global_bucket.acquire()
+            await bucket.acquire()
+            try:
+                async with self.session.post(url, json=payload, headers=headers) as response:
+                    if response.status < 300:
+                        self.counters["sent"] += 1
+                        print(f"{label}: message sent")
+                        return True
+                    body = await response.json(content_type=None) if response.content_type == "application/json" else {}
+                    if response.status == 429:
+                        # Telegram: {"parameters": {"retry_after": 5}}; Discord: {"retry_after": 1.5, "global": false}
+                        retry_after = (body.get("parameters") or {}).get("retry_after") or body.get("retry_after")
+                        retry_after = float(retry_after or response.headers.get("Retry-After") or self._backoff(attempt))
+                        (global_bucket if body.get("global") else bucket).pause(retry_after)
+                        print(f"{label}: rate limited, retrying in {retry_after:.1f}s")
+                    elif response.status >= 500:
+                        await asyncio.sleep(self._backoff(attempt))
+                    else:
+                        self.counters["failed"] += 1
+                        print(f"{label}: failed to send ({response.status}): {body or await response.text()}")
+                        return False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"{label}: connection error: {e}")
+                await asyncio.sleep(self._backoff(attempt))
+            self.counters["retries"] += 1
+        self.counters["failed"] += 1
+        print(f"{label}: giving up after {self.max_retries} retries")
+        return False
 
 # --- Main Orchestrator ---
 
 async def main():
-    # 1. Fetch Data Once
-    market_data = fetch_all_market_data()
+    # 1. Resolve destinations and the tickers each one receives
+    subscriptions = configured_subscriptions()
+    if not subscriptions:
+        print("No tasks configured (missing tokens for both Discord and Telegram).")
+        return
+
+    # 2. Fetch Data Once (for the union of all subscribed tickers)
+    market_data = fetch_all_market_data(tickers=subscribed_tickers(subscriptions))
     
     if not market_data:
         print("No market data fetched. Exiting.")
         return
 
-    # 2. Prepare Common Market Report
-    report = prepare_market_report(market_data)
+    # 3. Prepare a MarketReport per destination (alerts only, if rules are configured)
+    reports = build_reports(market_data, subscriptions)
+    if not reports:
+        return
 
-    # 3. Run Sending Tasks Concurrently
-    tasks = []
-    
-    if DISCORD_TOKEN:
-        tasks.append(run_discord_task(report))
-    else:
-        print("Discord token not set.")
-        
-    if TELEGRAM_TOKEN:
-        tasks.append(run_telegram_task(report))
-    else:
-        print("Telegram token not set.")
-        
-    if not tasks:
+    # 4. Fan the reports out through the notifier (one pooled session for every destination)
+    print(f"Delivering reports to {len(reports)} destination(s)...")
+    async with Notifier() as notifier:
+        for destination, report in reports.items():
+            notifier.submit(destination, report)
+
+async def run_daemon(interval=DAEMON_INTERVAL):
+    """Publishes reports every `interval` seconds over one persistent notifier.
+
+    The notifier's pooled HTTP session (and its TLS connections) is set up once
+    and reused for every report and destination.
+    """
+    subscriptions = configured_subscriptions()
+    if not subscriptions:
         print("No tasks configured (missing tokens for both Discord and Telegram).")
         return
+    tickers = subscribed_tickers(subscriptions)
 
-    await asyncio.gather(*tasks)
-    
-    # Allow underlying aiohttp/SSL connections to close gracefully
-    await asyncio.sleep(0.250)
+    print(f"--- Daemon started: publishing to {len(subscriptions)} destination(s) every {interval}s ---")
+    async with Notifier() as notifier:
+        while True:
+            started = time.monotonic()
+            # yfinance is blocking; keep the event loop (and pending deliveries) responsive
+            market_data = await asyncio.to_thread(fetch_all_market_data, None, tickers)
+            if market_data:
+                for destination, report in build_reports(market_data, subscriptions).items():
+                    notifier.submit(destination, report)
+                await notifier.flush()
+            else:
+                print("No market data fetched. Skipping this cycle.")
+            await asyncio.sleep(max(0, interval - (time.monotonic() - started)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stock Alert Bot")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and publish a report every --interval seconds")
+    parser.add_argument("--interval", type=int, default=DAEMON_INTERVAL,
+                        help="Seconds between reports in daemon mode (default: %(default)s)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    try:
+        asyncio.run(run_daemon(args.interval) if args.daemon else main())
+        if _market_cache:
+            # Let stale quotes finish refreshing so the next run starts warm
+            _market_cache.wait_for_refresh()
+    except KeyboardInterrupt:
+        print("Stopped.")
@@ -48,21 +48,33 @@ st.markdown("""
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
-# --- HELPERS ---
-def process_documents_ui(docs, api_key):
-    pdf_files = [f for f in docs if f.name.lower().endswith('.pdf')]
-    epub_files = [f for f in docs if f.name.lower().endswith('.epub')]
-    
-    raw_text = ""
-    if pdf_files: raw_text += doc_processor.extract_text_from_pdf(pdf_files)
-    if epub_files: raw_text += doc_processor.extract_text_from_epub(epub_files)
-    
-    if not raw_text.strip():
-        return False, "No text found in documents."
+INDEX_NAME = "faiss_index_pro"
 
-    chunks = doc_processor.get_text_chunks(raw_text, chunk_size=5000, chunk_overlap=500)
-    doc_processor.build_vector_store(chunks, api_key, index_name="faiss_index_pro")
-    return True, f"Processed {len(chunks)} text segments."
+# --- HELPERS ---
+@st.fragment(run_every="2s")
+def render_indexing_jobs():
+    # Polls the background job table; the rest of the page (and the chat) is not re-run
+    jobs = doc_processor.get_indexing_queue()
+    recent = jobs.list_jobs(INDEX_NAME, limit=5)
+    active = [job for job in recent if job["status"] in ("queued", "running")]
+    for job in reversed(active):
+        total = max(job["files_total"], 1)
+        stage = job["stage"] or job["status"]
+        st.progress(job["files_done"] / total,
+                    text=f"Job {job['id']}: {stage} · {job['files_done']}/{job['files_total']} files · "
+                         f"{job['chunks_done']} chunks")
+        if job["cancel_requested"]:
+            st.caption("Cancelling...")
+        elif st.button("Cancel", key=f"cancel_{job['id']}"):
+            jobs.cancel(job["id"])
+    finished = next((job for job in recent if job["status"] not in ("queued", "running")), None)
+    if finished and not active:
+        if finished["status"] == "done":
+            st.success(finished["message"])
+        elif finished["status"] == "cancelled":
+            st.warning(finished["message"])
+        else:
+            st.error(f"Indexing failed: {finished['message']}")
 
 # --- MAIN UI ---
 def main():
@@ -78,6 +90,22 @@ def main():
         else:
             st.success("API Key loaded (Jan 2026 Tier)")
         
+        backend = st.selectbox(
+            "Embedding backend", ["google", "local-hashing", "local-minilm"],
+            help="Local backends embed on this machine (offline, no quota); answers still come from Gemini. "
+                 "Re-process documents after switching."
+        )
+        retrieval_mode = st.radio(
+            "Retrieval mode", ["hybrid", "vector", "lexical"],
+            help="Lexical uses the local BM25 index only, with no embedding call per question."
+        )
+
+        token_budget = st.slider(
+            "Context token budget", min_value=1000, max_value=16000,
+            value=doc_processor.CONTEXT_TOKEN_BUDGET, step=500,
+            help="Retrieved passages are deduplicated and trimmed to fit this many tokens."
+        )
+
         st.divider()
         st.info("Supported formats: PDF, EPUB. Using RAG for massive documents.")
 
@@ -87,21 +115,24 @@ def main():
     with tab2:
         st.subheader("Upload Documents")
         uploaded_files = st.file_uploader("Upload PDF or EPUB files", accept_multiple_files=True, type=["pdf", "epub"])
+        parallel = st.toggle("Parallel extraction", value=True, help="Extract files and large PDF page ranges in worker processes.")
+        index_type = st.selectbox(
+            "Index type", doc_processor.INDEX_TYPES,
+            help="Flat is exact; IVF, HNSW and IVF-PQ trade a little recall for speed and memory on large libraries."
+        )
         if st.button("Process & Index"):
             if not api_key:
                 st.error("Please set your API key in the sidebar.")
             elif not uploaded_files:
                 st.error("Please upload at least one document.")
             else:
-                with st.status("Preprocessing knowledge base...", expanded=True) as status:
-                    st.write("Extracting text...")
-                    success, msg = process_documents_ui(uploaded_files, api_key)
-                    if success:
-                        status.update(label="Processing Complete!", state="complete", expanded=False)
-                        st.success(msg)
-                    else:
-                        status.update(label="Process Failed", state="error")
-                        st.error(msg)
+                # Indexing runs in a background job; chat keeps using the current index until it is swapped
+                doc_processor.get_indexing_queue().submit(
+                    uploaded_files, api_key, index_name=INDEX_NAME, chunk_size=5000, chunk_overlap=500,
+                    index_type=index_type, backend=backend, parallel=parallel
+                )
+                st.toast("Indexing started in the background.")
+        render_indexing_jobs()
 
     with tab1:
         # Display chat history
@@ -113,7 +144,7 @@ def main():
         if prompt := st.chat_input("Ask a question about your documents..."):
             if not api_key:
                 st.error("Set API key in sidebar.")
-            elif not os.path.exists("faiss_index_pro"):
+            elif not doc_processor.index_exists(INDEX_NAME):
                 st.error("Please process documents in the 'Knowledge Base' tab first.")
             else:
                 # Add user message to history
@@ -123,14 +154,27 @@ def main():
 
                 # Generate response
                 with st.chat_message("assistant"):
-                    with st.spinner("Analyzing documents..."):
-                        try:
-                            full_response = doc_processor.query_documents(prompt, api_key, index_name="faiss_index_pro")
-                            st.markdown(full_response)
-                            # Add assistant response to history
-                            st.session_state.chat_history.append({"role": "assistant", "content": full_response})
-                        except Exception as e:
-                            st.error(f"Error: {str(e)}")
+                    try:
+                        # Stream tokens into the bubble as they arrive
+                        stats = {}
+                        full_response = st.write_stream(
+                            doc_processor.stream_query_documents(
+                                prompt, api_key, index_name=INDEX_NAME, mode=retrieval_mode,
+                                token_budget=token_budget, stats=stats, backend=backend
+                            )
+                        )
+                        if stats.get("cached"):
+                            st.caption("Answered from cache")
+                        else:
+                            st.caption(f"{stats['passages']} passages · ~{stats['prompt_tokens']} prompt tokens")
+                        if stats.get("citations"):
+                            with st.expander("Sources"):
+                                for citation in stats["citations"]:
+                                    st.markdown(f"- {citation['label']}")
+                        # Add assistant response to history
+                        st.session_state.chat_history.append({"role": "assistant", "content": full_response})
+                    except Exception as e:
+                        st.error(f"Error: {str(e)}")
 
     # Auto-scroll or Footer
     st.markdown("---")
@@ -11,6 +11,7 @@ load_dotenv()
 
 def main():
     api_key = os.getenv("GOOGLE_API_KEY")
+    backend = os.getenv("DOC_EMBEDDING_BACKEND", "google")
     if not api_key:
         print("Error: GOOGLE_API_KEY not found in environment.")
         return
@@ -24,25 +25,24 @@ def main():
 
     # Process based on extension
     print("Processing document...")
-    raw_text = ""
     if file_path.lower().endswith('.pdf'):
-        with open(file_path, "rb") as f:
-            raw_text = doc_processor.extract_text_from_pdf([f])
+        extract_pages = doc_processor.iter_pdf_pages
     elif file_path.lower().endswith('.epub'):
-        with open(file_path, "rb") as f:
-            raw_text = doc_processor.extract_text_from_epub([f])
+        extract_pages = doc_processor.iter_epub_items
     else:
         print("Error: Unsupported file format. Please use PDF or EPUB.")
         return
 
-    if not raw_text.strip():
+    # Stream pages -> chunks -> embeddings without loading the whole text
+    with open(file_path, "rb") as f:
+        chunks = doc_processor.iter_text_chunks(extract_pages([f]))
+        chunk_count = doc_processor.build_vector_store(chunks, api_key, index_name="faiss_index_cli", backend=backend)
+
+    if not chunk_count:
         print("Error: Could not extract text from document.")
         return
 
-    # Build vector store
-    chunks = doc_processor.get_text_chunks(raw_text)
-    doc_processor.build_vector_store(chunks, api_key, index_name="faiss_index_cli")
-    print(f"Index built with {len(chunks)} chunks.")
+    print(f"Index built with {chunk_count} chunks.")
 
     print("\n--- Chat Started (Type 'quit' to exit) ---")
     while True:
@@ -51,8 +51,17 @@ def main():
             break
         
         try:
-            response = doc_processor.query_documents(user_query, api_key, index_name="faiss_index_cli")
-            print(f"Bot: {response}")
+            stats = {}
+            print("Bot: ", end="", flush=True)
+            for token in doc_processor.stream_query_documents(
+                user_query, api_key, index_name="faiss_index_cli", stats=stats, backend=backend
+            ):
+                print(token, end="", flush=True)
+            print()
+            if not stats.get("cached"):
+                print(f"[{stats['passages']} passages, ~{stats['prompt_tokens']} prompt tokens]")
+            for citation in stats.get("citations", []):
+                print(f"  - {citation['label']}")
         except Exception as e:
             print(f"Error: {e}")
 
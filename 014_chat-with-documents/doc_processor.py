@@ -1,77 +1,1865 @@
 import os
+import json
+import mmap
+import multiprocessing
+import re
+import math
+import random
+import asyncio
+import zlib
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import unquote
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import faiss
+import numpy as np
 from pypdf import PdfReader
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.docstore.base import AddableMixin, Docstore
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain
 
-def extract_text_from_pdf(pdf_files):
-    """Extracts text from a list of PDF file-like objects."""
-    text = ""
+EMBEDDING_MODEL = "models/text-embedding-004"
+LLM_MODEL = "gemini-2.5-flash"
+MAX_LOADED_INDEXES = 4
+MANIFEST_FILE = "manifest.json"
+FAISS_FILE = "index.faiss"
+CHUNK_BLOB_FILE = "chunks.bin"
+CHUNK_OFFSETS_FILE = "chunks.offsets.npy"
+CHUNK_IDS_FILE = "chunks.ids.json"
+BM25_FILE = "bm25.json"
+INDEX_PARAMS_FILE = "index_params.json"
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+MIN_VECTORS_FOR_INDEX_TYPE = {"flat": 0, "ivf": 1_000, "hnsw": 1_000, "ivfpq": 10_000}
+RRF_K = 60
+ANSWER_CACHE_TTL = 3600
+ANSWER_CACHE_MAX_ENTRIES = 256
+CONTEXT_TOKEN_BUDGET = 4000
+CHARS_PER_TOKEN = 4
+MIN_OVERLAP_CHARS = 40
+EMBEDDING_CACHE_PATH = os.getenv("DOC_EMBEDDING_CACHE", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+EMBED_BATCH_SIZE = 100
+EMBED_MAX_CONCURRENCY = 4
+EMBED_MAX_RETRIES = 6
+PDF_PAGES_PER_TASK = 50
+EPUB_ITEMS_PER_TASK = 20
+MIN_SECTION_CHARS = 1000  # smaller PDF sections are merged into the next one
+HASHING_EMBEDDING_DIM = 1024
+SENTENCE_TRANSFORMER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+INDEXING_JOBS_DIR = os.getenv("DOC_INDEXING_JOBS_DIR", "indexing_jobs")
+JOB_PROGRESS_EVERY = 20  # chunks between progress writes / cancellation checks
+
+# --- Embedding Cache ---
+
+class EmbeddingCache:
+    """SQLite store of float32 vectors keyed by model name + text hash, with LRU eviction."""
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, kind, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{kind}:{digest}"
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys present in the cache."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs, evicting least recently used entries when full."""
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                # Trim to 90% so eviction doesn't run on every insert
+                excess = count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (excess,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an EmbeddingCache."""
+    def __init__(self, embeddings, model, cache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def _lookup(self, texts):
+        keys = [self.cache.make_key(self.model, "doc", t) for t in texts]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return keys, found, missing
+
+    def _store(self, keys, found, missing, vectors):
+        new_items = list(zip(missing.keys(), vectors))
+        self.cache.put_many(new_items)
+        found.update(new_items)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        keys, found, missing = self._lookup(texts)
+        vectors = self.embeddings.embed_documents(list(missing.values())) if missing else []
+        return self._store(keys, found, missing, vectors)
+
+    async def aembed_documents(self, texts):
+        keys, found, missing = self._lookup(texts)
+        vectors = await self.embeddings.aembed_documents(list(missing.values())) if missing else []
+        return self._store(keys, found, missing, vectors)
+
+    def embed_query(self, text):
+        key = self.cache.make_key(self.model, "query", text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many([(key, vector)])
+        return vector
+
+# --- Embedding Scheduler ---
+
+def _is_rate_limit_error(exc):
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    message = str(exc)
+    return code == 429 or "429" in message or "RESOURCE_EXHAUSTED" in message
+
+def _run_coroutine(coro):
+    """Runs a coroutine to completion, even if this thread already has an event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+class EmbeddingScheduler:
+    """Embeds texts in batches with bounded concurrency, 429 backoff and checkpointing.
+
+    Finished batches are appended to a JSONL checkpoint, so an interrupted build
+    picks up the already embedded chunks instead of starting over.
+    """
+    def __init__(self, embeddings, model, batch_size=EMBED_BATCH_SIZE, max_concurrency=EMBED_MAX_CONCURRENCY,
+                 max_retries=EMBED_MAX_RETRIES, checkpoint_path=None):
+        self.embeddings = embeddings
+        self.model = model
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.checkpoint_path = checkpoint_path
+        self.requests = 0
+        self.retries = 0
+        self._checkpoint = self._load_checkpoint()
+        self._resume_at = 0.0
+
+    def _load_checkpoint(self):
+        vectors = {}
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return vectors
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn final line from a crash
+                if record.get("model") == self.model:
+                    vectors[record["id"]] = record["vector"]
+        if vectors:
+            print(f"Resuming from checkpoint: {len(vectors)} chunks already embedded.")
+        return vectors
+
+    def _append_checkpoint(self, ids, vectors):
+        if not self.checkpoint_path:
+            return
+        with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            for cid, vector in zip(ids, vectors):
+                f.write(json.dumps({"model": self.model, "id": cid, "vector": list(vector)}) + "\n")
+
+    def clear_checkpoint(self):
+        self._checkpoint.clear()
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    async def _embed_batch(self, texts, semaphore):
+        attempt = 0
+        async with semaphore:
+            while True:
+                # Every worker backs off together after a 429
+                wait = self._resume_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    self.requests += 1
+                    return await self.embeddings.aembed_documents(texts)
+                except Exception as e:
+                    if not _is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+                    delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                    attempt += 1
+                    self.retries += 1
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                    print(f"Rate limited, retrying batch in {delay:.1f}s (attempt {attempt}/{self.max_retries})...")
+
+    async def aembed(self, ids, texts):
+        """Returns one vector per text, skipping ids found in the checkpoint."""
+        results = {cid: self._checkpoint.pop(cid) for cid in ids if cid in self._checkpoint}
+        todo = [(cid, text) for cid, text in zip(ids, texts) if cid not in results]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(batch):
+            batch_ids = [cid for cid, _ in batch]
+            vectors = await self._embed_batch([text for _, text in batch], semaphore)
+            self._append_checkpoint(batch_ids, vectors)
+            results.update(zip(batch_ids, vectors))
+
+        await asyncio.gather(*(run(todo[i:i + self.batch_size]) for i in range(0, len(todo), self.batch_size)))
+        return [results[cid] for cid in ids]
+
+    def embed(self, ids, texts):
+        return _run_coroutine(self.aembed(ids, texts))
+
+@lru_cache(maxsize=1)
+def get_embedding_cache():
+    """Returns the process-wide embedding cache."""
+    return EmbeddingCache()
+
+# --- Backends ---
+
+BACKENDS = {}
+
+def register_backend(name, embedding_model, embeddings_factory, llm_factory):
+    """Makes an embedding/LLM pair selectable through the `backend` argument.
+
+    `embeddings_factory(api_key)` must return a LangChain Embeddings object and
+    `llm_factory(api_key)` a chat model (or any Runnable returning a message).
+    `embedding_model` names the vector space; indexes built with another model are rebuilt.
+    """
+    BACKENDS[name] = {
+        "embedding_model": embedding_model,
+        "embeddings": embeddings_factory,
+        "llm": llm_factory,
+    }
+    get_embeddings.cache_clear()
+    get_llm.cache_clear()
+    get_document_chain.cache_clear()
+
+def _get_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}. Available: {sorted(BACKENDS)}")
+    return BACKENDS[backend]
+
+def embedding_model_name(backend="google"):
+    return _get_backend(backend)["embedding_model"]
+
+@lru_cache(maxsize=1 << 18)
+def _feature_hash(feature):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(feature.encode("utf-8"))
+
+class HashingEmbeddings(Embeddings):
+    """Local CPU embeddings via signed feature hashing of word unigrams and bigrams.
+
+    No model download and no network; a whole batch is accumulated into one NumPy
+    matrix, log-scaled and L2-normalized, so texts sharing terms land close together.
+    """
+    def __init__(self, dim=HASHING_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, texts):
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            hashes = np.fromiter((_feature_hash(f) for f in features), dtype=np.uint32, count=len(features))
+            rows.append(np.full(len(hashes), row, dtype=np.int64))
+            columns.append((hashes % self.dim).astype(np.int64))
+            signs.append(np.where(hashes >> 31, 1.0, -1.0).astype(np.float32))
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if rows:
+            np.add.at(matrix, (np.concatenate(rows), np.concatenate(columns)), np.concatenate(signs))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return (matrix / np.where(norms == 0, 1, norms)).tolist()
+
+    def embed_documents(self, texts):
+        return self._embed(texts)
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """Local CPU embeddings from a small sentence-transformers model (optional dependency)."""
+    def __init__(self, model_name=SENTENCE_TRANSFORMER_MODEL, batch_size=64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("The local-minilm backend needs `pip install sentence-transformers`.") from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        return self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def benchmark_embedding_backends(texts, api_key=None, backends=("local-hashing", "google")):
+    """Embeds `texts` with each backend, bypassing the cache, and reports throughput."""
+    results = {}
+    for backend in backends:
+        try:
+            embedder = _get_backend(backend)["embeddings"](api_key)
+            start = time.perf_counter()
+            vectors = embedder.embed_documents(list(texts))
+            elapsed = time.perf_counter() - start
+            results[backend] = {
+                "texts": len(texts),
+                "seconds": round(elapsed, 3),
+                "texts_per_sec": round(len(texts) / elapsed, 1) if elapsed else float("inf"),
+                "dim": len(vectors[0]) if vectors else 0,
+            }
+        except Exception as e:
+            results[backend] = {"error": str(e)}
+    return results
+
+def _standin_answer(prompt_value):
+    """Offline stand-in for Gemini: echoes the start of the packed context."""
+    text = prompt_value.to_string()
+    context = text.split("Context:", 1)[-1].rsplit("Question:", 1)[0].strip()
+    return AIMessage(content=f"[stand-in answer] {context[:300]}")
+
+# --- Client & Index Registry ---
+
+@lru_cache(maxsize=8)
+def get_embeddings(api_key, backend="google"):
+    """Returns a shared, disk-cached embeddings client for the given API key."""
+    config = _get_backend(backend)
+    return CachedEmbeddings(config["embeddings"](api_key), config["embedding_model"], get_embedding_cache())
+
+@lru_cache(maxsize=8)
+def get_llm(api_key, backend="google"):
+    """Returns a shared chat model client for the given API key."""
+    return _get_backend(backend)["llm"](api_key)
+
+QA_PROMPT = ChatPromptTemplate.from_template("""
+    Answer the question as detailed as possible from the provided context. 
+    If the answer is not in the context, just say: "The answer is not available in the context." 
+    Do not provide incorrect information.
+
+    Context:
+    {context}
+
+    Question: 
+    {input}
+    """)
+
+@lru_cache(maxsize=8)
+def get_document_chain(api_key, backend="google"):
+    """Returns a shared stuff-documents QA chain bound to the chat model."""
+    return create_stuff_documents_chain(get_llm(api_key, backend), QA_PROMPT)
+
+register_backend(
+    "google", EMBEDDING_MODEL,
+    lambda api_key: GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key),
+    lambda api_key: ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=api_key, temperature=0.3),
+)
+# Local CPU embeddings, Gemini for answers
+register_backend(
+    "local-hashing", f"hashing-{HASHING_EMBEDDING_DIM}",
+    lambda api_key: HashingEmbeddings(),
+    lambda api_key: ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=api_key, temperature=0.3),
+)
+register_backend(
+    "local-minilm", SENTENCE_TRANSFORMER_MODEL,
+    lambda api_key: SentenceTransformerEmbeddings(),
+    lambda api_key: ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=api_key, temperature=0.3),
+)
+# Deterministic, network-free backend for tests and local development
+register_backend(
+    "standin", f"standin-hashing-{HASHING_EMBEDDING_DIM}",
+    lambda api_key: HashingEmbeddings(),
+    lambda api_key: RunnableLambda(_standin_answer),
+)
+
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+def index_lock(index_name, purpose="swap"):
+    """Per-index lock shared by everything in this process.
+
+    "swap" guards the moment index files are replaced or loaded, so readers never
+    see a half-written index; "write" serializes whole builds of the same index.
+    """
+    key = (os.path.abspath(index_name), purpose)
+    with _index_locks_guard:
+        return _index_locks.setdefault(key, threading.RLock())
+
+def index_exists(index_name):
+    """Whether an index exists; waits for an in-progress swap_index instead of seeing the gap."""
+    with index_lock(index_name):
+        return os.path.exists(index_name)
+
+def _index_mtime(index_name):
+    """Latest modification time of the files making up an index."""
+    paths = [os.path.join(index_name, f) for f in os.listdir(index_name)]
+    return max((os.path.getmtime(p) for p in paths), default=os.path.getmtime(index_name))
+
+# --- Native Index Storage ---
+
+class MmapDocstore(Docstore, AddableMixin):
+    """Docstore over one memory-mapped blob of chunks plus an offsets table.
+
+    Row i of `offsets` holds (start, text_end, end): the UTF-8 chunk text is
+    blob[start:text_end] and its JSON metadata is blob[text_end:end]. Nothing is
+    decoded until `search` asks for a chunk; changes since the last save live in memory.
+    """
+    def __init__(self, blob=b"", offsets=None, ids=()):
+        self._blob = blob
+        self._offsets = offsets if offsets is not None else np.zeros((0, 3), dtype=np.int64)
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self._added = {}
+        self._deleted = set()
+
+    def search(self, search):
+        if search in self._added:
+            return self._added[search]
+        position = self._positions.get(search)
+        if position is None or search in self._deleted:
+            return f"ID {search} not found."
+        start, text_end, end = (int(x) for x in self._offsets[position])
+        return Document(id=search, page_content=self._blob[start:text_end].decode("utf-8"),
+                        metadata=json.loads(self._blob[text_end:end]))
+
+    def add(self, texts):
+        overlapping = [doc_id for doc_id in texts if doc_id in self._added
+                       or (doc_id in self._positions and doc_id not in self._deleted)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids):
+        for doc_id in ids:
+            if doc_id in self._added:
+                del self._added[doc_id]
+            elif doc_id in self._positions and doc_id not in self._deleted:
+                self._deleted.add(doc_id)
+            else:
+                raise ValueError(f"Tried to delete ids that does not exist: {doc_id}")
+
+def _write_chunk_store(vector_store, index_name):
+    """Writes the blob/offsets/ids files for every chunk, in FAISS position order."""
+    ids = [vector_store.index_to_docstore_id[i] for i in range(vector_store.index.ntotal)]
+    offsets = np.zeros((len(ids), 3), dtype=np.int64)
+    blob_path = os.path.join(index_name, CHUNK_BLOB_FILE)
+    with open(blob_path + ".tmp", "wb") as f:
+        position = 0
+        for row, doc_id in enumerate(ids):
+            doc = vector_store.docstore.search(doc_id)
+            text = doc.page_content.encode("utf-8")
+            meta = json.dumps(doc.metadata).encode("utf-8")
+            f.write(text)
+            f.write(meta)
+            offsets[row] = (position, position + len(text), position + len(text) + len(meta))
+            position += len(text) + len(meta)
+
+    offsets_path = os.path.join(index_name, CHUNK_OFFSETS_FILE)
+    with open(offsets_path + ".tmp", "wb") as f:
+        np.save(f, offsets)
+    ids_path = os.path.join(index_name, CHUNK_IDS_FILE)
+    with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    for path in (blob_path, offsets_path, ids_path):
+        os.replace(path + ".tmp", path)
+
+def _save_vector_store(vector_store, index_name):
+    """Persists raw FAISS binary + columnar chunk store (no pickle)."""
+    os.makedirs(index_name, exist_ok=True)
+    faiss_path = os.path.join(index_name, FAISS_FILE)
+    faiss.write_index(vector_store.index, faiss_path + ".tmp")
+    _write_chunk_store(vector_store, index_name)
+    os.replace(faiss_path + ".tmp", faiss_path)
+    legacy_path = os.path.join(index_name, "index.pkl")
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+def _load_vector_store(index_name, embeddings, writable=False):
+    """Opens an index saved by _save_vector_store.
+
+    Read-only loads memory-map both the FAISS index and the chunk blob, so opening
+    is near-instant and chunk text is only read for the hits a query returns.
+    """
+    ids_path = os.path.join(index_name, CHUNK_IDS_FILE)
+    if not os.path.exists(ids_path):
+        raise FileNotFoundError("Index is missing or uses the old pickle format. Please process documents again.")
+
+    faiss_path = os.path.join(index_name, FAISS_FILE)
+    flags = 0 if writable else faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    index = faiss.read_index(faiss_path, flags)
+    with open(ids_path, "r", encoding="utf-8") as f:
+        ids = json.load(f)
+    offsets = np.load(os.path.join(index_name, CHUNK_OFFSETS_FILE), mmap_mode=None if writable else "r")
+    with open(os.path.join(index_name, CHUNK_BLOB_FILE), "rb") as f:
+        blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    index_info = load_index_params(index_name)
+    if index_info:
+        _apply_search_params(index, index_info["params"])
+    return FAISS(embedding_function=embeddings, index=index, docstore=MmapDocstore(blob, offsets, ids),
+                 index_to_docstore_id=dict(enumerate(ids)))
+
+# --- Index Factory ---
+
+def load_index_params(index_name):
+    """Returns the persisted index type/params/report of an index, or None."""
+    path = os.path.join(index_name, INDEX_PARAMS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_index_params(index_name, index_info):
+    path = os.path.join(index_name, INDEX_PARAMS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index_info, f, indent=2)
+    os.replace(tmp_path, path)
+
+def default_index_params(index_type, n_vectors, dim):
+    """Reasonable build/search parameters for an index type and corpus size."""
+    if index_type == "flat":
+        return {}
+    if index_type == "hnsw":
+        return {"M": 32, "efConstruction": 80, "efSearch": 64}
+    # IVF: ~4*sqrt(n) lists, keeping >= 39 training points per list
+    nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    params = {"nlist": nlist, "nprobe": max(1, min(64, nlist // 8))}
+    if index_type == "ivfpq":
+        # ~8 dimensions per sub-quantizer, 8 bits per code
+        params["m"] = max(d for d in range(1, dim // 8 + 1) if dim % d == 0)
+        params["nbits"] = 8
+    return params
+
+def _factory_string(index_type, params):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{params['M']}"
+    if index_type == "ivf":
+        return f"IVF{params['nlist']},Flat"
+    if index_type == "ivfpq":
+        return f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}"
+    raise ValueError(f"Unknown index type: {index_type}. Choose one of {INDEX_TYPES}.")
+
+def _apply_search_params(index, params):
+    if "nprobe" in params:
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    if "efSearch" in params:
+        index.hnsw.efSearch = params["efSearch"]
+
+def create_faiss_index(index_type, vectors, params):
+    """Builds an (untrained -> trained) FAISS index of the given type from a vector matrix."""
+    dim = vectors.shape[1]
+    index = faiss.index_factory(dim, _factory_string(index_type, params), faiss.METRIC_L2)
+    if "efConstruction" in params:
+        index.hnsw.efConstruction = params["efConstruction"]
+    if not index.is_trained:
+        # Train on a random sample; IVF/PQ need only a few dozen points per centroid
+        sample_size = min(len(vectors), max(params.get("nlist", 1) * 64, 256 * 64))
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    _apply_search_params(index, params)
+    return index
+
+def evaluate_index(index, vectors, k=10, n_queries=100):
+    """Measures recall@k and per-query latency of `index` against exact search."""
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return {
+        f"recall@{k}": hits / truth.size,
+        "query_ms": round(ann_ms, 4),
+        "exact_query_ms": round(exact_ms, 4),
+        "index_bytes": len(faiss.serialize_index(index)),
+    }
+
+def _stored_vectors(vector_store, scheduler):
+    """All vectors in the store, in index order.
+
+    Flat, HNSW and IVF-Flat indexes hold the exact vectors, which are read back.
+    IVF-PQ keeps only compressed codes, so its texts are re-embedded through the
+    build's EmbeddingScheduler (batched, with 429 backoff; the embedding cache
+    serves them locally when it still has them).
+    """
+    index = vector_store.index
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat)):
+        return index.reconstruct_n(0, index.ntotal)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and isinstance(faiss.downcast_index(ivf), faiss.IndexIVFFlat):
+        # Reconstructing by position needs a direct map; drop it again so remove_ids keeps working
+        ivf.make_direct_map()
+        try:
+            return index.reconstruct_n(0, index.ntotal)
+        finally:
+            ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    ids = [vector_store.index_to_docstore_id[i] for i in range(index.ntotal)]
+    texts = [vector_store.docstore.search(doc_id).page_content for doc_id in ids]
+    return np.asarray(scheduler.embed(ids, texts), dtype=np.float32)
+
+def _rebuild_index(vector_store, scheduler, index_type, params):
+    """Swaps the store's FAISS index for a freshly built one of the given type."""
+    vectors = _stored_vectors(vector_store, scheduler)
+    index = create_faiss_index(index_type, vectors, params)
+    vector_store.index = index
+    report = evaluate_index(index, vectors) if index_type != "flat" else {}
+    return report
+
+def _delete_chunks(vector_store, scheduler, ids, index_info):
+    index = vector_store.index
+    if isinstance(index, faiss.IndexFlat):
+        vector_store.delete(ids)
+        return
+    # HNSW graphs don't support removal, and IVF removal keeps the old positions as labels
+    # while the docstore mapping is renumbered: delete from a flat copy of the vectors instead
+    vectors = _stored_vectors(vector_store, scheduler)
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    vector_store.index = flat
+    vector_store.delete(ids)
+    if faiss.try_extract_index_ivf(index) is not None:
+        # Keep the trained centroids; only the surviving vectors are re-added
+        index.reset()
+        index.add(flat.reconstruct_n(0, flat.ntotal))
+        vector_store.index = index
+    else:
+        _rebuild_index(vector_store, scheduler, index_info["index_type"], index_info["params"])
+
+# --- Lexical Index ---
+
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+
+def tokenize(text):
+    """Lowercased word tokens; keeps part numbers like "AB-12.3" together."""
+    return _TOKEN_RE.findall(text.lower())
+
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from has have how in is it its of on or that the this "
+    "to was were what when where which who why will with".split()
+)
+
+def _bm25_terms(text):
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+class BM25Index:
+    """Local inverted index over chunk ids, scored with Okapi BM25."""
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}     # term -> {doc_id: term frequency}
+        self.doc_lengths = {}  # doc_id -> token count
+
+    def add(self, doc_id, text):
+        tokens = _bm25_terms(text)
+        self.doc_lengths[doc_id] = len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            self.postings.setdefault(token, {})[doc_id] = tf
+
+    def search(self, query, k=4):
+        """Returns up to k (doc_id, score) pairs, best first."""
+        if not self.doc_lengths:
+            return []
+        n_docs = len(self.doc_lengths)
+        avg_len = sum(self.doc_lengths.values()) / n_docs
+        scores = {}
+        for term in set(_bm25_terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "postings": self.postings, "doc_lengths": self.doc_lengths}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        return index
+
+def _build_bm25(vector_store):
+    """Builds the lexical index from the chunks currently in the vector store."""
+    bm25 = BM25Index()
+    for doc_id in vector_store.index_to_docstore_id.values():
+        bm25.add(doc_id, vector_store.docstore.search(doc_id).page_content)
+    return bm25
+
+class IndexRegistry:
+    """Process-wide LRU cache of loaded vector and lexical indexes, invalidated by file mtime."""
+    def __init__(self, max_size=MAX_LOADED_INDEXES):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # path -> {"mtime": ..., kind: (owner, value)}
+        self._lock = threading.Lock()
+
+    def _get(self, index_name, kind, owner, loader):
+        key = os.path.abspath(index_name)
+        with index_lock(index_name):
+            mtime = _index_mtime(index_name)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry["mtime"] == mtime and kind in entry and entry[kind][0] is owner:
+                    self._entries.move_to_end(key)
+                    return entry[kind][1]
+            value = loader()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry["mtime"] != mtime:
+                entry = self._entries[key] = {"mtime": mtime}
+            entry[kind] = (owner, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def get(self, index_name, embeddings):
+        """Returns the FAISS vector store for an index."""
+        return self._get(index_name, "faiss", embeddings, lambda: _load_vector_store(index_name, embeddings))
+
+    def get_bm25(self, index_name):
+        """Returns the BM25 lexical index for an index, or None if it has none."""
+        path = os.path.join(index_name, BM25_FILE)
+        return self._get(index_name, "bm25", None, lambda: BM25Index.load(path) if os.path.exists(path) else None)
+
+    def get_model(self, index_name):
+        """Returns the embedding model an index was built with, or None if unknown."""
+        def load():
+            manifest = load_manifest(index_name)
+            return manifest["model"] if manifest else None
+        return self._get(index_name, "model", None, load)
+
+    def invalidate(self, index_name=None):
+        with self._lock:
+            if index_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(index_name), None)
+
+index_registry = IndexRegistry()
+
+# --- Answer Cache ---
+
+def normalize_question(question):
+    """Case/whitespace/trailing-punctuation insensitive form of a question."""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+def _unit_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class AnswerCache:
+    """LRU cache of generated answers keyed by index version, retrieval settings + normalized question.
+
+    Entries expire after `ttl` seconds. If `similarity_threshold` is set, a question
+    whose embedding has at least that cosine similarity to a cached one is a hit too.
+    """
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, answer, unit question vector)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(index_name, mode, question, token_budget, backend):
+        # The question comes last: near-duplicate matching compares everything before it
+        path = os.path.abspath(index_name)
+        with index_lock(index_name):
+            # Index saves hold this lock, so their *.tmp files are never listed half-renamed
+            version = _index_mtime(index_name)
+        return (path, version, mode, token_budget, backend, normalize_question(question))
+
+    def get(self, index_name, mode, question, question_vector=None, token_budget=CONTEXT_TOKEN_BUDGET,
+            backend="google"):
+        key = self._key(index_name, mode, question, token_budget, backend)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] < now:
+                del self._entries[key]
+                entry = None
+            if entry is None and self.similarity_threshold is not None and question_vector is not None:
+                entry = self._find_similar(key, question_vector, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return entry[1]
+
+    def _find_similar(self, key, question_vector, now):
+        query = _unit_vector(question_vector)
+        best, best_score = None, self.similarity_threshold
+        for other_key, entry in self._entries.items():
+            if other_key[:-1] != key[:-1] or entry[0] < now or entry[2] is None:
+                continue
+            score = float(np.dot(query, entry[2]))
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, index_name, mode, question, answer, question_vector=None, token_budget=CONTEXT_TOKEN_BUDGET,
+            backend="google"):
+        key = self._key(index_name, mode, question, token_budget, backend)
+        vector = _unit_vector(question_vector) if question_vector is not None else None
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, answer, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index_name=None):
+        with self._lock:
+            if index_name is None:
+                self._entries.clear()
+                return
+            path = os.path.abspath(index_name)
+            for key in [k for k in self._entries if k[0] == path]:
+                del self._entries[key]
+
+answer_cache = AnswerCache()
+
+# --- Context Packing ---
+
+def estimate_tokens(text):
+    """Cheap local token estimate (~4 characters per token), no API call."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def _overlap_length(first, second, max_overlap=4000):
+    """Length of the longest suffix of `first` that is also a prefix of `second`."""
+    tail = first[-max_overlap:]
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = tail.find(probe)
+    while start != -1:
+        if second.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+def _dedupe_passage(text, metadata, selected):
+    """Strips text already present in the selected passages of the same source."""
+    for other in selected:
+        if other.metadata.get("source") != metadata.get("source"):
+            continue
+        if text in other.page_content:
+            return ""
+        text = text[_overlap_length(other.page_content, text):]
+        overlap = _overlap_length(text, other.page_content)
+        if overlap:
+            text = text[:-overlap]
+    return text.strip()
+
+def _truncate_to_tokens(text, max_tokens):
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    if len(cut) < len(text) and " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip() + " ..."
+
+def format_citation(metadata):
+    """Human-readable location of a chunk, e.g. "report.pdf, p. 3-4 (2.1 Related Work)"."""
+    label = metadata.get("source", "document")
+    if "page" in metadata:
+        label += f", p. {metadata['page']}"
+        if metadata.get("page_end"):
+            label += f"-{metadata['page_end']}"
+    elif "section" in metadata:
+        label += f", section {metadata['section']}"
+    if metadata.get("heading"):
+        label += f" ({metadata['heading']})"
+    return label
+
+def get_citations(passages):
+    """Unique citations for the passages, in the order they were used."""
+    citations = {}
+    for passage in passages:
+        label = format_citation(passage.metadata)
+        if label not in citations:
+            citations[label] = {
+                **{k: passage.metadata[k] for k in ("source", "page", "page_end", "section", "heading")
+                   if k in passage.metadata},
+                "label": label,
+            }
+    return list(citations.values())
+
+def pack_context(docs, question="", token_budget=CONTEXT_TOKEN_BUDGET):
+    """Deduplicates overlapping chunks and fits them into a token budget.
+
+    `docs` must be ordered by relevance; the most relevant passages are kept first
+    and the first one that doesn't fit is truncated. Returns (passages, stats).
+    """
+    passages = []
+    dropped = 0
+    used = 0
+    for doc in docs:
+        text = _dedupe_passage(doc.page_content, doc.metadata, passages)
+        if not text:
+            dropped += 1
+            continue
+        remaining = token_budget - used
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if remaining < 50:
+                dropped += 1
+                continue
+            text = _truncate_to_tokens(text, remaining)
+            tokens = estimate_tokens(text)
+        passages.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+        used += tokens
+
+    prompt = QA_PROMPT.format(context="\n\n".join(p.page_content for p in passages), input=question)
+    stats = {
+        "retrieved": len(docs),
+        "passages": len(passages),
+        "dropped": dropped,
+        "context_tokens": used,
+        "prompt_tokens": estimate_tokens(prompt),
+        "citations": get_citations(passages),
+    }
+    return passages, stats
+
+# --- Extraction ---
+
+def _source_name(file):
+    return os.path.basename(getattr(file, "name", "") or "document")
+
+def iter_pdf_pages(pdf_files):
+    """Yields (text, metadata) for each PDF page, one page at a time."""
     for pdf in pdf_files:
+        source = _source_name(pdf)
         pdf_reader = PdfReader(pdf)
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
-    return text
+        for page_number, page in enumerate(pdf_reader.pages, start=1):
+            yield page.extract_text() or "", {"source": source, "page": page_number}
+
+_WHITESPACE_RE = re.compile(r"[ \t\r\n\f]+")
+
+class HTMLTextExtractor(HTMLParser):
+    """Streaming HTML-to-text converter (no DOM is built).
+
+    Skips scripts, styles and the <head>, collapses whitespace like a browser,
+    turns block elements into paragraph breaks and <br> into line breaks, and
+    remembers the first h1-h3 as the heading.
+    """
+    SKIP_TAGS = {"script", "style", "head", "template", "noscript"}
+    BLOCK_TAGS = {"p", "div", "section", "article", "header", "footer", "aside", "nav", "blockquote",
+                  "pre", "ul", "ol", "li", "dl", "dt", "dd", "table", "tr", "figure", "figcaption",
+                  "hr", "h1", "h2", "h3", "h4", "h5", "h6", "body"}
+    HEADING_TAGS = {"h1", "h2", "h3"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self.heading = None
+        self._parts = []
+        self._skip = 0
+        self._pre = 0
+        self._heading_tag = None
+        self._heading_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag == "br":
+            self._parts.append("\n")
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+            if tag == "pre":
+                self._pre += 1
+            if tag in self.HEADING_TAGS and self.heading is None and self._heading_tag is None:
+                self._heading_tag = tag
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+            if tag == "pre":
+                self._pre = max(self._pre - 1, 0)
+            if tag == self._heading_tag:
+                self.heading = " ".join("".join(self._heading_parts).split()) or None
+                self._heading_tag = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self._parts.append(data if self._pre else _WHITESPACE_RE.sub(" ", data))
+        if self._heading_tag:
+            self._heading_parts.append(data)
+
+    def _flush(self):
+        text = "".join(self._parts)
+        self._parts = []
+        if self._pre:
+            text = text.strip("\n")
+        else:
+            text = "\n".join(line.strip() for line in text.split("\n") if line.strip())
+        if text:
+            self.paragraphs.append(text)
+
+    def get_text(self):
+        self.close()
+        self._flush()
+        return "\n\n".join(self.paragraphs)
+
+_XML_ENCODING_RE = re.compile(rb"""^<\?xml[^>]*encoding=["']([A-Za-z0-9._-]+)["']""")
+
+def html_to_text(content):
+    """Returns (text, first h1-h3 heading or None) for an (X)HTML document."""
+    if isinstance(content, bytes):
+        declared = _XML_ENCODING_RE.match(content[:200].lstrip())
+        content = content.decode(declared.group(1).decode("ascii") if declared else "utf-8", errors="replace")
+    parser = HTMLTextExtractor()
+    parser.feed(content)
+    return parser.get_text(), parser.heading
+
+def _epub_document_names(book_zip):
+    """Zip paths of an EPUB's (X)HTML documents, in manifest order."""
+    container = ElementTree.fromstring(book_zip.read("META-INF/container.xml"))
+    rootfile = next(el for el in container.iter() if el.tag.endswith("rootfile"))
+    opf_path = rootfile.get("full-path")
+    opf_dir = posixpath.dirname(opf_path)
+    names = []
+    for element in ElementTree.fromstring(book_zip.read(opf_path)).iter():
+        if element.tag.endswith("}item") and element.get("media-type") == "application/xhtml+xml":
+            names.append(posixpath.normpath(posixpath.join(opf_dir, unquote(element.get("href")))))
+    return names
+
+def _epub_page(book_zip, name, source, section):
+    text, heading = html_to_text(book_zip.read(name))
+    metadata = {"source": source, "section": section}
+    if heading:
+        metadata["heading"] = heading
+    return text + "\n", metadata
+
+def iter_epub_items(epub_files):
+    """Yields (text, metadata) for each EPUB document item, one item at a time.
+
+    Items are read straight from the zip (images and fonts are never loaded) and
+    converted with the streaming HTMLTextExtractor.
+    """
+    for epub_file in epub_files:
+        source = _source_name(epub_file)
+        with zipfile.ZipFile(epub_file) as book_zip:
+            for section, name in enumerate(_epub_document_names(book_zip), start=1):
+                yield _epub_page(book_zip, name, source, section)
+
+def iter_document_pages(files):
+    """Yields (text, metadata) pages from a mixed list of PDF and EPUB files."""
+    for file in files:
+        name = getattr(file, "name", "").lower()
+        if name.endswith('.pdf'):
+            yield from iter_pdf_pages([file])
+        elif name.endswith('.epub'):
+            yield from iter_epub_items([file])
+
+def _extract_pdf_range(path, source, start, stop):
+    """Worker: extracts pages [start, stop) of a PDF on disk."""
+    pdf_reader = PdfReader(path)
+    return [(pdf_reader.pages[i].extract_text() or "", {"source": source, "page": i + 1})
+            for i in range(start, stop)]
+
+def _extract_epub_range(path, source, names, first_section):
+    """Worker: extracts the given document items of an EPUB on disk."""
+    with zipfile.ZipFile(path) as book_zip:
+        return [_epub_page(book_zip, name, source, section)
+                for section, name in enumerate(names, start=first_section)]
+
+def _spool_to_disk(file, tmp_dir):
+    """Returns a path for the file, writing in-memory uploads to tmp_dir once."""
+    try:
+        file.fileno()
+        return file.name  # already a real file on disk
+    except (AttributeError, OSError):
+        pass
+    path = os.path.join(tmp_dir, f"{len(os.listdir(tmp_dir))}_{_source_name(file)}")
+    if hasattr(file, "seek"):
+        file.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(file, out)
+    return path
+
+def extract_documents_parallel(files, max_workers=None, progress_callback=None,
+                               pages_per_task=PDF_PAGES_PER_TASK, items_per_task=EPUB_ITEMS_PER_TASK):
+    """Extracts (text, metadata) pages from PDF/EPUB files across a process pool.
+
+    Files are split into tasks of `pages_per_task` PDF pages or `items_per_task`
+    EPUB document items. Pages are yielded in document order as soon as the
+    preceding tasks finish, and `progress_callback(source, done, total)` is called
+    from the caller's thread after each file.
+
+    Workers are spawned rather than forked, since the caller may hold locks
+    in other threads (the indexing queue, the embedding scheduler). If the
+    generator is closed early, e.g. when an indexing job is cancelled, tasks
+    that have not started yet are dropped instead of run to completion.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        finished = False
+        try:
+            yield from _extract_with_pool(pool, files, tmp_dir, progress_callback, pages_per_task, items_per_task)
+            finished = True
+        finally:
+            # Wait for running tasks either way so the spooled files outlive their readers
+            pool.shutdown(wait=True, cancel_futures=not finished)
+
+def _extract_with_pool(pool, files, tmp_dir, progress_callback, pages_per_task, items_per_task):
+    file_tasks = []
+    for file in files:
+        source = _source_name(file)
+        lower = source.lower()
+        if lower.endswith('.pdf'):
+            path = _spool_to_disk(file, tmp_dir)
+            page_count = len(PdfReader(path).pages)
+            futures = [pool.submit(_extract_pdf_range, path, source, start,
+                                   min(start + pages_per_task, page_count))
+                       for start in range(0, page_count, pages_per_task)]
+        elif lower.endswith('.epub'):
+            path = _spool_to_disk(file, tmp_dir)
+            with zipfile.ZipFile(path) as book_zip:
+                names = _epub_document_names(book_zip)
+            futures = [pool.submit(_extract_epub_range, path, source, names[start:start + items_per_task],
+                                   start + 1)
+                       for start in range(0, len(names), items_per_task)]
+        else:
+            continue
+        file_tasks.append((source, futures))
+
+    for done, (source, futures) in enumerate(file_tasks, start=1):
+        for future in futures:
+            yield from future.result()
+        if progress_callback:
+            progress_callback(source, done, len(file_tasks))
+
+def extract_text_from_pdf(pdf_files):
+    """Extracts text from a list of PDF file-like objects."""
+    return "".join(text for text, _ in iter_pdf_pages(pdf_files))
 
 def extract_text_from_epub(epub_files):
     """Extracts text from a list of EPUB file-like objects."""
-    text = ""
-    for epub_file in epub_files:
-        book = epub.read_epub(epub_file)
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                text += soup.get_text() + "\n"
-    return text
+    return "".join(text for text, _ in iter_epub_items(epub_files))
+
+# --- Chunking & Indexing ---
 
 def get_text_chunks(text, chunk_size=10000, chunk_overlap=1000):
     """Splits text into manageable chunks."""
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     return text_splitter.split_text(text)
 
-def build_vector_store(chunks, api_key, index_name="faiss_index"):
-    """Creates and saves a FAISS vector store from text chunks."""
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=api_key)
-    vector_store = FAISS.from_texts(chunks, embedding=embeddings)
-    vector_store.save_local(index_name)
-    return True
+_HEADING_RE = re.compile(
+    r"^(?:(?:Chapter|Section|Part|Appendix|CHAPTER|SECTION|PART|APPENDIX)\s+(?:\d+|[IVXLC]+|[A-Z])\b.{0,70}"  # "Chapter 3: Results"
+    r"|\d+(?:\.\d+)*\.?\s+[A-Z][^.!?;:]{1,70}"                 # "2.1 Related Work"
+    r"|[A-Z][A-Z ,'&()-]{3,70})$"                                 # "INTRODUCTION"
+)
+
+def _is_heading(line):
+    line = line.strip()
+    if not 4 <= len(line) <= 80 or line[-1] in ".,;" or len(line.split()) > 12:
+        return False
+    return bool(_HEADING_RE.match(line))
+
+def split_at_headings(text):
+    """Splits a PDF page into (heading or None, text) blocks at heading-like lines."""
+    blocks = []
+    heading, start, offset = None, 0, 0
+    for line in text.splitlines(keepends=True):
+        if _is_heading(line):
+            if offset > start:
+                blocks.append((heading, text[start:offset]))
+            heading, start = line.strip(), offset
+        offset += len(line)
+    if offset > start or not blocks:
+        blocks.append((heading, text[start:]))
+    return blocks
+
+def _structured_pages(pages):
+    """Splits PDF pages at headings and tags every block with the heading it belongs to.
+
+    EPUB items already carry their own `section`/`heading`, so they pass through.
+    """
+    current = {}  # source -> heading in effect
+    for text, metadata in pages:
+        if "page" not in metadata:
+            yield text, metadata
+            continue
+        source = metadata.get("source")
+        for heading, block in split_at_headings(text):
+            if heading:
+                current[source] = heading
+            block_meta = dict(metadata)
+            if current.get(source):
+                block_meta["heading"] = current[source]
+            yield block, block_meta
+
+def _is_section_break(previous, metadata, section_len):
+    """Whether a new chunking section starts at `metadata`."""
+    if metadata.get("source") != previous.get("source"):
+        return True
+    if metadata.get("section") != previous.get("section"):
+        return True  # EPUB document boundary
+    # New PDF heading; tiny sections are merged to avoid a flood of small chunks
+    return metadata.get("heading") != previous.get("heading") and section_len >= MIN_SECTION_CHARS
+
+def iter_text_chunks(pages, chunk_size=10000, chunk_overlap=1000, structure_aware=True):
+    """Lazily splits (text, metadata) pages into chunk Documents.
+
+    Only the current section's unsplit tail is buffered, so memory stays bounded
+    regardless of page count. Chunks never span two source files and carry the
+    metadata of the page they start on (plus `page_end` when they run onto later pages).
+    With `structure_aware`, chunks also never span two EPUB documents or two PDF
+    sections (split at heading-like lines), and carry the section `heading`.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    buffer_parts = []
+    offsets = []      # start offset of each buffered page
+    metadatas = []    # metadata of each buffered page
+    buffer_len = 0
+
+    def split_buffer(final):
+        nonlocal buffer_parts, offsets, metadatas, buffer_len
+        buffer = "".join(buffer_parts)
+        docs = text_splitter.create_documents([buffer])
+        if not final and len(docs) > 1:
+            # Keep the last (possibly incomplete) chunk for the next round
+            carry_from = docs[-1].metadata["start_index"]
+            docs = docs[:-1]
+        else:
+            carry_from = len(buffer)
+        for doc in docs:
+            start = doc.metadata.pop("start_index")
+            page_meta = dict(metadatas[max(bisect_right(offsets, start) - 1, 0)])
+            end_meta = metadatas[max(bisect_right(offsets, start + len(doc.page_content) - 1) - 1, 0)]
+            if end_meta.get("page", page_meta.get("page")) != page_meta.get("page"):
+                page_meta["page_end"] = end_meta["page"]
+            yield Document(page_content=doc.page_content, metadata=page_meta)
+
+        # Rebase the carried tail
+        keep = max(bisect_right(offsets, carry_from) - 1, 0)
+        buffer_parts = [buffer[carry_from:]]
+        metadatas = metadatas[keep:]
+        offsets = [0] + [o - carry_from for o in offsets[keep + 1:]]
+        buffer_len = len(buffer_parts[0])
 
-def query_documents(question, api_key, index_name="faiss_index"):
-    """Retrieves relevant chunks and generates an answer using Gemini."""
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=api_key)
+    section_len = 0   # characters since the current section started
+    if structure_aware:
+        pages = _structured_pages(pages)
+    for text, metadata in pages:
+        if structure_aware and not text.strip():
+            continue
+        if metadatas and (metadata.get("source") != metadatas[-1].get("source") or
+                          structure_aware and _is_section_break(metadatas[-1], metadata, section_len)):
+            yield from split_buffer(final=True)
+            buffer_parts, offsets, metadatas, buffer_len, section_len = [], [], [], 0, 0
+        offsets.append(buffer_len)
+        metadatas.append(metadata)
+        buffer_parts.append(text)
+        buffer_len += len(text)
+        section_len += len(text)
+        if buffer_len >= chunk_size * 2:
+            yield from split_buffer(final=False)
+
+    if metadatas:
+        yield from split_buffer(final=True)
+
+def chunk_id(text):
+    """Stable content hash used as the docstore id of a chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_manifest(index_name):
+    """Returns the chunk manifest of an index, or None if there is none."""
+    path = os.path.join(index_name, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_manifest(index_name, manifest):
+    path = os.path.join(index_name, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def _resolve_index_type(index_type, index_params, n_vectors, dim, index_info):
+    """Picks the index structure to persist and whether the FAISS index must be rebuilt."""
+    target_type = index_type
+    if n_vectors < MIN_VECTORS_FOR_INDEX_TYPE[index_type]:
+        print(f"Only {n_vectors} vectors: using a flat index until the corpus reaches "
+              f"{MIN_VECTORS_FOR_INDEX_TYPE[index_type]} for '{index_type}'.")
+        target_type = "flat"
+    if target_type == index_info["index_type"]:
+        params = {**index_info["params"], **(index_params or {})}
+        # Re-train IVF centroids once the corpus has doubled since training
+        stale = "nlist" in params and n_vectors > 2 * index_info.get("trained_on", n_vectors)
+        if params == index_info["params"] and not stale:
+            return index_info, False
+    params = {**default_index_params(target_type, n_vectors, dim), **(index_params or {})}
+    if target_type == "flat":
+        params = {}
+    return {"index_type": target_type, "requested_type": index_type, "params": params,
+            "trained_on": n_vectors, "report": {}}, True
+
+def build_vector_store(chunks, api_key, index_name="faiss_index", batch_size=EMBED_BATCH_SIZE,
+                       max_concurrency=EMBED_MAX_CONCURRENCY, index_type="flat", index_params=None,
+                       backend="google", append=False):
+    """Creates or incrementally updates a FAISS vector store from text chunks.
+
+    `chunks` may be any iterable of strings or Documents (e.g. from `iter_text_chunks`);
+    it is consumed lazily and embedded by an EmbeddingScheduler in batches of `batch_size`
+    with up to `max_concurrency` requests in flight. Progress is checkpointed next to the
+    index, so a build that fails (e.g. on quota) resumes where it stopped. Chunks are keyed by
+    content hash in a manifest stored with the index, so only new chunks are embedded
+    and chunks that are no longer present are deleted. With `append=True` the chunks are
+    added to the existing index and nothing is deleted.
+    `index_type` selects the FAISS structure ("flat", "ivf", "hnsw" or "ivfpq"); its
+    parameters (overridable via `index_params`) and a recall/latency report are
+    persisted with the index so queries load the same structure.
+    Returns the number of chunks in the index (0 if no text was found).
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}. Choose one of {INDEX_TYPES}.")
+    # Concurrent builds of the same index would clobber each other
+    with index_lock(index_name, "write"):
+        return _build_vector_store(chunks, api_key, index_name, batch_size, max_concurrency,
+                                   index_type, index_params, backend, append)
+
+def _build_vector_store(chunks, api_key, index_name, batch_size, max_concurrency, index_type,
+                        index_params, backend, append):
+    embeddings = get_embeddings(api_key, backend)
+    model = embedding_model_name(backend)
+
+    manifest = load_manifest(index_name)
+    if append and manifest and manifest.get("model") != model:
+        raise ValueError(f"Index '{index_name}' was built with {manifest.get('model')}; "
+                         f"cannot append chunks embedded with {model}.")
+    vector_store = None
+    indexed_ids = set()
+    if manifest and manifest.get("model") == model:
+        try:
+            vector_store = _load_vector_store(index_name, embeddings, writable=True)
+            indexed_ids = set(manifest["chunks"])
+        except Exception as e:
+            print(f"Existing index unreadable, rebuilding: {e}")
+    index_info = (vector_store is not None and load_index_params(index_name)) or {
+        "index_type": "flat", "requested_type": index_type, "params": {}, "trained_on": 0, "report": {}
+    }
+
+    scheduler = EmbeddingScheduler(embeddings, model, batch_size=batch_size,
+                                   max_concurrency=max_concurrency,
+                                   checkpoint_path=f"{index_name}.checkpoint.jsonl")
+    chunk_ids = {}  # ordered set of every chunk id seen
+    if append and indexed_ids:
+        # Keep everything already indexed; only chunks not in the manifest get embedded
+        chunk_ids = dict.fromkeys(manifest["chunks"])
+    pending = []
+    embedded_count = 0
+
+    def flush():
+        nonlocal vector_store, embedded_count
+        texts = [doc.page_content for doc in pending]
+        vectors = scheduler.embed([doc.id for doc in pending], texts)
+        text_embeddings = list(zip(texts, vectors))
+        metadatas = [doc.metadata for doc in pending]
+        ids = [doc.id for doc in pending]
+        if vector_store is None:
+            vector_store = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+        else:
+            vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        embedded_count += len(pending)
+        pending.clear()
+
+    for chunk in chunks:
+        doc = chunk if isinstance(chunk, Document) else Document(page_content=chunk)
+        cid = chunk_id(doc.page_content)
+        if cid in chunk_ids:
+            continue
+        chunk_ids[cid] = None
+        if cid not in indexed_ids:
+            pending.append(Document(id=cid, page_content=doc.page_content, metadata=doc.metadata))
+            if len(pending) >= batch_size * max_concurrency:
+                flush()
+    if pending:
+        flush()
+
+    if not chunk_ids:
+        # Nothing extracted: leave any existing index untouched
+        scheduler.clear_checkpoint()
+        return 0
+
+    removed_ids = [cid for cid in indexed_ids if cid not in chunk_ids]
+    if removed_ids:
+        _delete_chunks(vector_store, scheduler, removed_ids, index_info)
+
+    new_info, rebuild = _resolve_index_type(index_type, index_params, vector_store.index.ntotal,
+                                            vector_store.index.d, index_info)
+    has_bm25 = os.path.exists(os.path.join(index_name, BM25_FILE))
+    if not embedded_count and not removed_ids and not rebuild and has_bm25:
+        print("Index is up to date, nothing to embed.")
+        scheduler.clear_checkpoint()
+        return len(chunk_ids)
+
+    if rebuild:
+        new_info["report"] = _rebuild_index(vector_store, scheduler, new_info["index_type"], new_info["params"])
+        if new_info["report"]:
+            print(f"Built {new_info['index_type']} index {new_info['params']}: {new_info['report']}")
+
+    bm25 = _build_bm25(vector_store)
+    with index_lock(index_name):
+        _save_vector_store(vector_store, index_name)
+        _save_index_params(index_name, new_info)
+        bm25.save(os.path.join(index_name, BM25_FILE))
+        _save_manifest(index_name, {"model": model, "chunks": list(chunk_ids)})
+        index_registry.invalidate(index_name)
+        answer_cache.invalidate(index_name)
+    scheduler.clear_checkpoint()
+    print(f"Index updated: {embedded_count} embedded, {len(removed_ids)} removed, "
+          f"{len(chunk_ids) - embedded_count} reused ({scheduler.requests} embedding requests, "
+          f"{scheduler.retries} rate-limit retries).")
+    return len(chunk_ids)
+
+def _reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """Merges several ranked lists of doc ids into one (best first)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+def retrieve_documents(question, api_key, index_name="faiss_index", k=4, mode="hybrid", backend="google"):
+    """Returns the k chunks most relevant to the question.
+
+    mode: "vector" (FAISS only), "lexical" (local BM25 only, no embedding call) or
+    "hybrid" (both, merged with reciprocal-rank fusion).
+    """
+    embeddings = get_embeddings(api_key, backend)
     
-    # Load vector store
-    if not os.path.exists(index_name):
+    # Load vector store (served from the in-memory registry when unchanged on disk)
+    if not index_exists(index_name):
         raise FileNotFoundError("Vector index not found. Please process documents first.")
         
-    vector_db = FAISS.load_local(index_name, embeddings, allow_dangerous_deserialization=True)
-    docs = vector_db.similarity_search(question, k=4)
+    index_model = index_registry.get_model(index_name)
+    if index_model and index_model != embedding_model_name(backend):
+        raise ValueError(f"Index was built with '{index_model}' embeddings; "
+                         f"query it with the matching backend or process the documents again.")
 
-    # Initialize LLM
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key, temperature=0.3)
-    
-    # Modern Prompt & Chain
-    prompt = ChatPromptTemplate.from_template("""
-    Answer the question as detailed as possible from the provided context. 
-    If the answer is not in the context, just say: "The answer is not available in the context." 
-    Do not provide incorrect information.
+    vector_db = index_registry.get(index_name, embeddings)
+    bm25 = index_registry.get_bm25(index_name) if mode in ("hybrid", "lexical") else None
+    if bm25 is None:
+        if mode == "lexical":
+            raise FileNotFoundError("Lexical index not found. Please process documents again.")
+        return vector_db.similarity_search(question, k=k)
 
-    Context:
-    {context}
+    lexical_ids = [doc_id for doc_id, _ in bm25.search(question, k=k * 4)]
+    if mode == "lexical":
+        doc_ids = lexical_ids[:k]
+    else:
+        vector_ids = [doc.id for doc in vector_db.similarity_search(question, k=k * 4)]
+        doc_ids = _reciprocal_rank_fusion([vector_ids, lexical_ids], k)
+    return [vector_db.docstore.search(doc_id) for doc_id in doc_ids]
 
-    Question: 
-    {input}
-    """)
+def _cached_answer_lookup(question, api_key, index_name, mode, token_budget, backend):
+    """Returns (cached answer or None, question vector used for near-duplicate matching)."""
+    if not index_exists(index_name):
+        raise FileNotFoundError("Vector index not found. Please process documents first.")
+    question_vector = None
+    if answer_cache.similarity_threshold is not None and mode != "lexical":
+        # Retrieval embeds the question anyway, so this is served from the embedding cache
+        question_vector = get_embeddings(api_key, backend).embed_query(question)
+    return answer_cache.get(index_name, mode, question, question_vector, token_budget, backend), question_vector
+
+def prepare_context(question, api_key, index_name="faiss_index", mode="hybrid",
+                    token_budget=CONTEXT_TOKEN_BUDGET, backend="google"):
+    """Retrieves and packs the context for a question. Returns (passages, stats)."""
+    docs = retrieve_documents(question, api_key, index_name, mode=mode, backend=backend)
+    return pack_context(docs, question, token_budget)
+
+def query_documents(question, api_key, index_name="faiss_index", mode="hybrid", use_cache=True,
+                    token_budget=CONTEXT_TOKEN_BUDGET, stats=None, backend="google"):
+    """Retrieves relevant chunks and generates an answer using Gemini.
+
+    If a dict is passed as `stats`, it is filled with the context packing report
+    (passages kept, estimated prompt tokens, ...) and the `citations` (source, page or
+    section, heading and a display `label`) of the passages the answer was based on.
+    """
+    if use_cache:
+        cached, question_vector = _cached_answer_lookup(question, api_key, index_name, mode, token_budget,
+                                                        backend)
+        if cached is not None:
+            answer, citations = cached
+            if stats is not None:
+                stats.update(cached=True, prompt_tokens=0, citations=citations)
+            return answer
 
-    document_chain = create_stuff_documents_chain(llm, prompt)
+    docs, context_stats = prepare_context(question, api_key, index_name, mode, token_budget, backend)
+    if stats is not None:
+        stats.update(context_stats, cached=False)
+
+    # Reuse the LLM client and chain across questions
+    document_chain = get_document_chain(api_key, backend)
     response = document_chain.invoke({
         "input": question,
         "context": docs
     })
     
+    if use_cache:
+        answer_cache.put(index_name, mode, question, (response, context_stats["citations"]), question_vector,
+                         token_budget, backend)
     return response
+
+def stream_query_documents(question, api_key, index_name="faiss_index", mode="hybrid", use_cache=True,
+                           token_budget=CONTEXT_TOKEN_BUDGET, stats=None, backend="google"):
+    """Like query_documents, but yields the answer text as Gemini generates it."""
+    if use_cache:
+        cached, question_vector = _cached_answer_lookup(question, api_key, index_name, mode, token_budget,
+                                                        backend)
+        if cached is not None:
+            answer, citations = cached
+            if stats is not None:
+                stats.update(cached=True, prompt_tokens=0, citations=citations)
+            yield answer
+            return
+
+    docs, context_stats = prepare_context(question, api_key, index_name, mode, token_budget, backend)
+    if stats is not None:
+        stats.update(context_stats, cached=False)
+    document_chain = get_document_chain(api_key, backend)
+    tokens = []
+    for token in document_chain.stream({"input": question, "context": docs}):
+        if token:
+            tokens.append(token)
+            yield token
+
+    if use_cache:
+        answer_cache.put(index_name, mode, question, ("".join(tokens), context_stats["citations"]),
+                         question_vector, token_budget, backend)
+
+# --- Indexing Jobs ---
+
+class JobCancelled(Exception):
+    """Raised inside a running indexing job once cancellation was requested."""
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def swap_index(staging_name, index_name):
+    """Replaces index_name with the fully built index in staging_name.
+
+    The two renames happen under the index's swap lock, which every read path
+    (index_exists, the registry, the answer cache) takes before touching the
+    index, so readers see either the old or the new version, never neither.
+    """
+    old_name = f"{index_name}.old-{uuid.uuid4().hex[:8]}"
+    with index_lock(index_name, "write"), index_lock(index_name):
+        if os.path.exists(index_name):
+            os.rename(index_name, old_name)
+        os.rename(staging_name, index_name)
+        index_registry.invalidate(index_name)
+        answer_cache.invalidate(index_name)
+    # Readers that still map the old files keep them alive until they are closed
+    shutil.rmtree(old_name, ignore_errors=True)
+
+class IndexingJobQueue:
+    """Persistent queue of indexing jobs run one at a time by a background thread.
+
+    Jobs live in a SQLite table inside `jobs_dir`, together with a copy of their
+    uploaded files, so their status survives page refreshes and a job interrupted
+    by a restart is picked up again. A job is queued, running, done, failed or
+    cancelled. Each job builds into a staging copy of the index (hard links, so
+    unchanged chunks are reused) and swaps it in when done; until then queries
+    keep using the previous version. API keys are only kept in memory; jobs
+    resumed after a restart fall back to GOOGLE_API_KEY.
+    """
+    def __init__(self, jobs_dir=INDEXING_JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._api_keys = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._conn = sqlite3.connect(os.path.join(jobs_dir, "jobs.sqlite3"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, index_name TEXT NOT NULL, "
+            "status TEXT NOT NULL, stage TEXT, files_done INTEGER DEFAULT 0, files_total INTEGER DEFAULT 0, "
+            "chunks_done INTEGER DEFAULT 0, message TEXT, params TEXT NOT NULL, "
+            "cancel_requested INTEGER DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # Jobs that were running when the process died start over (embeddings are cached)
+        self._conn.execute("UPDATE jobs SET status = 'queued', stage = NULL WHERE status = 'running'")
+        self._conn.commit()
+        if self._conn.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone():
+            self.start()
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def submit(self, files, api_key, index_name="faiss_index", chunk_size=5000, chunk_overlap=500,
+               index_type="flat", backend="google", parallel=True):
+        """Copies the files into the job directory, queues the job and returns its id."""
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        names = []
+        for file in files:
+            # One sub-directory per file keeps the original name (it becomes the chunk `source`)
+            name = os.path.join(str(len(names)), _source_name(file))
+            os.makedirs(os.path.join(job_dir, str(len(names))))
+            if hasattr(file, "seek"):
+                file.seek(0)
+            with open(os.path.join(job_dir, name), "wb") as out:
+                shutil.copyfileobj(file, out)
+            names.append(name)
+        params = {"files": names, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap,
+                  "index_type": index_type, "backend": backend, "parallel": parallel}
+        now = time.time()
+        self._api_keys[job_id] = api_key
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, index_name, status, files_total, params, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, index_name, len(names), json.dumps(params), now, now),
+            )
+            self._conn.commit()
+        self.start()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self, index_name=None, limit=20):
+        """Most recent jobs first, optionally for one index."""
+        query, args = "SELECT * FROM jobs", ()
+        if index_name is not None:
+            query, args = query + " WHERE index_name = ?", (index_name,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at DESC LIMIT ?", (*args, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def cancel(self, job_id):
+        """Cancels a queued job, or asks a running one to stop at its next checkpoint."""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] not in ("queued", "running"):
+                return
+            queued = row["status"] == "queued"
+            if queued:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, message = ?, updated_at = ? "
+                    "WHERE id = ?", ("Cancelled; the previous index is unchanged.", time.time(), job_id))
+            else:
+                self._conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?",
+                                   (time.time(), job_id))
+            self._conn.commit()
+        if queued:
+            # The job never reaches _run, so its cleanup happens here
+            self._api_keys.pop(job_id, None)
+            shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+
+    def start(self):
+        """Starts the worker thread if it isn't running."""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name="indexing-jobs", daemon=True)
+                self._worker.start()
+        self._wakeup.set()
+
+    def _next_job(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = 'running', stage = 'starting', updated_at = ? "
+                               "WHERE id = ?", (time.time(), row["id"]))
+            self._conn.commit()
+        return dict(row)
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                if not self._wakeup.wait(timeout=60):
+                    return  # idle; `submit` starts a new worker
+                continue
+            self._run(job)
+
+    def _check_cancel(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and row["cancel_requested"]:
+            raise JobCancelled()
+
+    def _track_chunks(self, job_id, chunks):
+        """Passes chunks through, recording progress and honouring cancellation."""
+        count = 0
+        for chunk in chunks:
+            count += 1
+            if count % JOB_PROGRESS_EVERY == 0:
+                self._update(job_id, chunks_done=count)
+                self._check_cancel(job_id)
+            yield chunk
+        self._update(job_id, chunks_done=count, stage="saving")
+
+    def _run(self, job):
+        job_id, index_name = job["id"], job["index_name"]
+        params = json.loads(job["params"])
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        staging_name = f"{index_name}.staging-{job_id}"
+        api_key = self._api_keys.pop(job_id, None) or os.getenv("GOOGLE_API_KEY")
+        files = []
+        try:
+            # Start from the current index so unchanged chunks are reused, not re-embedded
+            shutil.rmtree(staging_name, ignore_errors=True)
+            if os.path.isdir(index_name):
+                with index_lock(index_name):
+                    shutil.copytree(index_name, staging_name, copy_function=_link_or_copy)
+
+            files = [open(os.path.join(job_dir, name), "rb") for name in params["files"]]
+            self._update(job_id, stage="indexing")
+            on_file = lambda source, done, total: self._update(job_id, files_done=done)
+            if params["parallel"]:
+                pages = extract_documents_parallel(files, progress_callback=on_file)
+            else:
+                pages = iter_document_pages(files)
+            chunks = iter_text_chunks(pages, chunk_size=params["chunk_size"], chunk_overlap=params["chunk_overlap"])
+            chunk_count = build_vector_store(
+                self._track_chunks(job_id, chunks), api_key, index_name=staging_name,
+                index_type=params["index_type"], backend=params["backend"],
+            )
+            if not chunk_count:
+                self._update(job_id, status="failed", stage=None, message="No text found in documents.")
+                return
+            self._check_cancel(job_id)
+            swap_index(staging_name, index_name)
+            self._update(job_id, status="done", stage=None, files_done=len(files),
+                         message=f"Processed {chunk_count} text segments.")
+        except JobCancelled:
+            self._update(job_id, status="cancelled", stage=None, message="Cancelled; the previous index is unchanged.")
+        except Exception as e:
+            self._update(job_id, status="failed", stage=None, message=str(e))
+        finally:
+            for file in files:
+                file.close()
+            shutil.rmtree(staging_name, ignore_errors=True)
+            if os.path.exists(f"{staging_name}.checkpoint.jsonl"):
+                os.remove(f"{staging_name}.checkpoint.jsonl")
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+@lru_cache(maxsize=1)
+def get_indexing_queue():
+    """Returns the process-wide indexing job queue."""
+    return IndexingJobQueue()
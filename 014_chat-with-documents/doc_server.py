@@ -0,0 +1,190 @@
+"""
+Task: 014_chat-with-documents
+Goal: Long-running multi-index document chat service around doc_processor.
+
+Every tenant/user gets their own named index under the data directory, so
+concurrent uploads no longer clobber a shared `faiss_index_pro`. Builds of the
+same index are serialized, queries run concurrently, and recently used indexes
+stay resident in memory (doc_processor.index_registry).
+
+API (JSON):
+    GET    /health
+    GET    /indexes                       -> list indexes
+    POST   /indexes/<name>/documents      -> {"files": [{"name": "a.pdf", "content_base64": "..."}],
+                                              "texts": [{"name": "notes", "text": "..."}],
+                                              "chunk_size": 5000, "chunk_overlap": 500, "index_type": "flat"}
+                                             adds the documents to the index
+    PUT    /indexes/<name>/documents      -> same body; replaces all documents of the index with these
+    POST   /indexes/<name>/query          -> {"question": "...", "mode": "hybrid", "token_budget": 4000}
+    DELETE /indexes/<name>
+
+Usage:
+    python 014_chat-with-documents/doc_server.py --port 8014
+    python 014_chat-with-documents/doc_server.py --backend standin   # offline, no API key
+
+Example Output:
+-------------
+$ curl -s -X POST localhost:8014/indexes/alice/query -d '{"question": "What is the secret code?"}'
+{"answer": "The secret code mentioned in the document is VIBE-2026.", "citations": [{"source": "handbook.pdf", "page": 12, "heading": "3. Access", "label": "handbook.pdf, p. 12 (3. Access)"}], "stats": {"passages": 4, "prompt_tokens": 2310, "cached": false}}
+-------------
+"""
+
+import os
+import io
+import re
+import json
+import base64
+import shutil
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import doc_processor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEX_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class DocumentService:
+    """Manages many named indexes in one data directory."""
+    def __init__(self, data_dir, api_key=None, backend="google"):
+        self.data_dir = data_dir
+        self.api_key = api_key
+        self.backend = backend
+        os.makedirs(data_dir, exist_ok=True)
+
+    def index_path(self, name):
+        if not INDEX_NAME_RE.match(name):
+            raise ValueError("Index names may only contain letters, digits, '-' and '_'.")
+        return os.path.join(self.data_dir, name)
+
+    def list_indexes(self):
+        indexes = []
+        for name in sorted(os.listdir(self.data_dir)):
+            path = os.path.join(self.data_dir, name)
+            manifest = doc_processor.load_manifest(path) if os.path.isdir(path) else None
+            if manifest:
+                indexes.append({"name": name, "chunks": len(manifest["chunks"]), "model": manifest["model"]})
+        return indexes
+
+    def add_documents(self, name, payload, replace=False):
+        """Indexes the uploaded files/texts; `replace` drops every chunk not in this upload."""
+        path = self.index_path(name)
+        files = []
+        for item in payload.get("files", []):
+            buffer = io.BytesIO(base64.b64decode(item["content_base64"]))
+            buffer.name = item["name"]
+            files.append(buffer)
+        texts = [(item["text"], {"source": item.get("name", "text")}) for item in payload.get("texts", [])]
+
+        def pages():
+            yield from doc_processor.iter_document_pages(files)
+            yield from texts
+
+        chunks = doc_processor.iter_text_chunks(
+            pages(), chunk_size=payload.get("chunk_size", 5000), chunk_overlap=payload.get("chunk_overlap", 500)
+        )
+        # build_vector_store serializes writers per index; readers keep using the old version
+        chunk_count = doc_processor.build_vector_store(
+            chunks, self.api_key, index_name=path, index_type=payload.get("index_type", "flat"),
+            backend=self.backend, append=not replace,
+        )
+        return {"index": name, "chunks": chunk_count}
+
+    def query(self, name, payload):
+        path = self.index_path(name)
+        if not doc_processor.index_exists(path):
+            raise FileNotFoundError(f"Index '{name}' not found.")
+        stats = {}
+        answer = doc_processor.query_documents(
+            payload["question"], self.api_key, index_name=path, mode=payload.get("mode", "hybrid"),
+            token_budget=payload.get("token_budget", doc_processor.CONTEXT_TOKEN_BUDGET),
+            stats=stats, backend=self.backend,
+        )
+        return {"answer": answer, "citations": stats.pop("citations", []), "stats": stats}
+
+    def delete_index(self, name):
+        path = self.index_path(name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Index '{name}' not found.")
+        with doc_processor.index_lock(path, "write"), doc_processor.index_lock(path):
+            shutil.rmtree(path)
+            doc_processor.index_registry.invalidate(path)
+            doc_processor.answer_cache.invalidate(path)
+        return {"deleted": name}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None  # set by make_server
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _route(self):
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+        try:
+            if self.command == "GET" and parts == ["health"]:
+                return self._send(200, {"status": "ok", "backend": self.service.backend})
+            if self.command == "GET" and parts == ["indexes"]:
+                return self._send(200, {"indexes": self.service.list_indexes()})
+            if len(parts) == 3 and parts[0] == "indexes" and parts[2] == "documents" and self.command == "PUT":
+                return self._send(200, self.service.add_documents(parts[1], self._read_json(), replace=True))
+            if len(parts) == 3 and parts[0] == "indexes" and self.command == "POST":
+                if parts[2] == "documents":
+                    return self._send(200, self.service.add_documents(parts[1], self._read_json()))
+                if parts[2] == "query":
+                    return self._send(200, self.service.query(parts[1], self._read_json()))
+            if len(parts) == 2 and parts[0] == "indexes" and self.command == "DELETE":
+                return self._send(200, self.service.delete_index(parts[1]))
+            self._send(404, {"error": "Not found"})
+        except FileNotFoundError as e:
+            self._send(404, {"error": str(e)})
+        except (ValueError, KeyError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    do_GET = _route
+    do_POST = _route
+    do_PUT = _route
+    do_DELETE = _route
+
+def make_server(host, port, service):
+    handler = type("BoundRequestHandler", (RequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-index document chat server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8014)
+    parser.add_argument("--data-dir", default="doc_indexes")
+    parser.add_argument("--backend", default="google", choices=sorted(doc_processor.BACKENDS))
+    parser.add_argument("--max-loaded", type=int, default=doc_processor.MAX_LOADED_INDEXES,
+                        help="How many indexes to keep resident in memory")
+    args = parser.parse_args()
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if args.backend == "google" and not api_key:
+        print("Error: GOOGLE_API_KEY not found in environment.")
+        return
+
+    doc_processor.index_registry.max_size = args.max_loaded
+    service = DocumentService(args.data_dir, api_key=api_key, backend=args.backend)
+    server = make_server(args.host, args.port, service)
+    print(f"--- 📄 Document Chat Server on http://{args.host}:{args.port} ({args.backend} backend) ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()